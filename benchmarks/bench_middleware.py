@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+'''
+Benchmark the XFF middleware hot path.
+
+Drives XForwardedForMiddleware directly with a stub get_response and
+prints the results as JSON. Compare two runs with --compare:
+
+    python benchmarks/bench_middleware.py > before.json
+    python benchmarks/bench_middleware.py --compare before.json
+'''
+import argparse
+import json
+import os
+import platform
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip(),
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-n', '--number', type=int, default=1000,
+                        help='requests per round')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='rounds per case, the best is reported')
+    parser.add_argument('-k', '--select',
+                        help='only run cases with this in the name')
+    parser.add_argument('--compare', metavar='JSON',
+                        help='previous results to compare against')
+    args = parser.parse_args()
+
+    settings.configure(ALLOWED_HOSTS=['*'], LOGGING_CONFIG=None,
+                       SECRET_KEY='bench')
+    django.setup()
+
+    from xff import bench
+    import logging
+    logging.getLogger('xff.middleware').disabled = True
+
+    results = bench.run(args.number, args.repeat, args.select)
+
+    if args.compare:
+        with open(args.compare) as previous:
+            old = json.load(previous)['results']
+        for name, before, after, ratio in bench.compare(old, results):
+            print('%-40s %10.0f %10.0f %6.2fx' % (name, before, after, ratio))
+        return
+
+    json.dump({
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'results': results,
+    }, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+'''
+Load test the XFF middleware with concurrent synthetic traffic.
+
+Serves a minimal Django app through a threaded wsgiref server on
+localhost, once with and once without the middleware, and replays the
+same traffic mix against both at the given concurrency:
+
+    python benchmarks/loadtest.py --requests 20000 --concurrency 16 \\
+        --spoofed 0.2 --overlong 0.01 --missing 0.05 --exempt 0.05
+
+Prints p50, p99 and p99.9 latencies in milliseconds as JSON.
+'''
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import socketserver
+import sys
+import threading
+import time
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.http import HttpResponse  # noqa: E402
+from django.urls import path  # noqa: E402
+
+DEPTH = 2
+
+
+def index(request):
+    return HttpResponse(request.META['REMOTE_ADDR'])
+
+
+urlpatterns = [
+    path('', index),
+    path('health/', index),
+]
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def make_traffic(count, spoofed, overlong, missing, exempt, seed=0):
+    '''
+    A list of (path, header) with the given shares of each kind.
+    '''
+    rnd = random.Random(seed)
+    traffic = []
+    for i in range(count):
+        client = '198.51.%d.%d' % (i >> 8 & 255, i & 255)
+        proxies = ['10.0.0.%d' % n for n in range(1, DEPTH)]
+        roll = rnd.random()
+        if roll < spoofed:
+            chain = ['203.0.113.%d' % rnd.randrange(256), client] + proxies
+        elif roll < spoofed + overlong:
+            chain = ['192.0.2.%d' % (n & 255) for n in range(100)] + [
+                client] + proxies
+        elif roll < spoofed + overlong + missing:
+            traffic.append(('/', None))
+            continue
+        elif roll < spoofed + overlong + missing + exempt:
+            traffic.append(('/health/', ', '.join([client] + proxies)))
+            continue
+        else:
+            chain = [client] + proxies
+        traffic.append(('/', ', '.join(chain)))
+    return traffic
+
+
+def percentile(ordered, fraction):
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def replay(port, traffic, concurrency):
+    '''
+    Send traffic from concurrency threads, return latencies and statuses.
+    '''
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    chunks = [traffic[i::concurrency] for i in range(concurrency)]
+
+    def worker(chunk):
+        local = []
+        codes = {}
+        for url, header in chunk:
+            headers = {'X-Forwarded-For': header} if header else {}
+            start = time.perf_counter()
+            connection = http.client.HTTPConnection('127.0.0.1', port)
+            connection.request('GET', url, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            connection.close()
+            local.append(time.perf_counter() - start)
+            codes[response.status] = codes.get(response.status, 0) + 1
+        with lock:
+            latencies.extend(local)
+            for code, count in codes.items():
+                statuses[code] = statuses.get(code, 0) + count
+
+    threads = [threading.Thread(target=worker, args=(chunk,))
+               for chunk in chunks]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return latencies, statuses, elapsed
+
+
+def serve(middleware):
+    from django.core.handlers.wsgi import WSGIHandler
+
+    settings.MIDDLEWARE = middleware
+    server = make_server('127.0.0.1', 0, WSGIHandler(),
+                         server_class=ThreadingWSGIServer,
+                         handler_class=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def run(name, middleware, traffic, concurrency):
+    server = serve(middleware)
+    try:
+        replay(server.server_port, traffic[:len(traffic) // 10 or 1],
+               concurrency)
+        latencies, statuses, elapsed = replay(
+            server.server_port, traffic, concurrency)
+    finally:
+        server.shutdown()
+        server.server_close()
+    latencies.sort()
+    return {
+        'name': name,
+        'requests': len(latencies),
+        'throughput': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'p99.9_ms': percentile(latencies, 0.999) * 1000,
+        'statuses': {str(code): count
+                     for code, count in sorted(statuses.items())},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--spoofed', type=float, default=0.1,
+                        help='share of chains with a forged entry')
+    parser.add_argument('--overlong', type=float, default=0.01,
+                        help='share of chains with 100 forged entries')
+    parser.add_argument('--missing', type=float, default=0.05,
+                        help='share of requests without the header')
+    parser.add_argument('--exempt', type=float, default=0.05,
+                        help='share of requests to an exempt URL')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--setting', action='append', default=[],
+                        metavar='NAME=JSON',
+                        help='extra XFF setting, eg. XFF_NO_SPOOFING=true')
+    args = parser.parse_args()
+
+    xff_settings = {
+        'XFF_TRUSTED_PROXY_DEPTH': DEPTH,
+        'XFF_EXEMPT_URLS': [r'^health/'],
+    }
+    for setting in args.setting:
+        name, value = setting.split('=', 1)
+        xff_settings[name] = json.loads(value)
+
+    settings.configure(
+        ALLOWED_HOSTS=['*'],
+        ROOT_URLCONF=__name__,
+        LOGGING_CONFIG=None,
+        SECRET_KEY='loadtest',
+        **xff_settings
+    )
+    django.setup()
+
+    traffic = make_traffic(args.requests, args.spoofed, args.overlong,
+                           args.missing, args.exempt, args.seed)
+    results = [
+        run('without', [], traffic, args.concurrency),
+        run('with', ['xff.middleware.XForwardedForMiddleware'], traffic,
+            args.concurrency),
+    ]
+    json.dump({
+        'concurrency': args.concurrency,
+        'settings': xff_settings,
+        'results': results,
+    }, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
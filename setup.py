@@ -26,7 +26,8 @@ setup(name='django-xff',
       author='Ferrix Hovi',
       author_email='ferrix@codetry.fi',
       install_requires=get_requirements('requirements.txt'),
-      packages=['xff'],
+      extras_require={'numpy': ['numpy']},
+      packages=['xff', 'xff.management', 'xff.management.commands'],
       url='https://github.com/ferrix/xff/',
       license='MIT License',
       classifiers=[
@@ -20,6 +20,6 @@ from tests.app.views import index
 
 urlpatterns = [
     re_path(r'^admin/', admin.site.urls),
-    re_path(r'^health/$', index),
+    re_path(r'^health/$', index, name='health'),
     re_path('^$', index),
 ]
@@ -0,0 +1,87 @@
+import gc
+import logging
+import tracemalloc
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+from xff import bench
+
+REQUESTS = 200
+
+# Upper bounds of (blocks, bytes) left allocated by each request. Most
+# of it is the request.headers cache and the rewritten META values.
+RETAINED_BUDGET = {
+    'no_header': (12, 800),
+    'correct_depth': (6, 400),
+    'spoofed': (6, 400),
+    'exempt': (16, 1200),
+}
+
+# Upper bounds of the peak bytes allocated during a request
+PEAK_BUDGET = {
+    'no_header': 3000,
+    'correct_depth': 3000,
+    'spoofed': 3000,
+    'exempt': 3000,
+}
+
+
+def measure(middleware, header, path='/'):
+    '''
+    Blocks and bytes still allocated per request after the middleware
+    ran, and the peak of bytes allocated during a single request.
+    '''
+    requests = bench.make_requests(header, path, REQUESTS, 2)
+    for request in requests[0]:
+        middleware(request)  # warm up caches and interned strings
+    requests = requests[1]
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        for request in requests[1:]:
+            middleware(request)
+        after = tracemalloc.take_snapshot()
+
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        middleware(requests[0])
+        peak = tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+
+    stats = after.compare_to(before, 'filename')
+    blocks = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+    count = len(requests) - 1
+    return blocks / count, size / count, peak
+
+
+@override_settings(XFF_TRUSTED_PROXY_DEPTH=2, XFF_EXEMPT_URLS=[r'^health/'])
+class TestAllocations(SimpleTestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def assert_budget(self, case, middleware, header, path='/'):
+        blocks, size, peak = measure(middleware, header, path)
+        max_blocks, max_size = RETAINED_BUDGET[case]
+        self.assertLessEqual(blocks, max_blocks, 'retained blocks')
+        self.assertLessEqual(size, max_size, 'retained bytes')
+        self.assertLessEqual(peak, PEAK_BUDGET[case], 'peak bytes')
+
+    def test_no_header(self):
+        self.assert_budget('no_header', bench.build(), None)
+
+    def test_correct_depth(self):
+        self.assert_budget('correct_depth', bench.build(),
+                           bench.make_header(2))
+
+    def test_spoofed(self):
+        self.assert_budget('spoofed', bench.build(), bench.make_header(4))
+
+    def test_exempt(self):
+        self.assert_budget('exempt', bench.build(), bench.make_header(2),
+                           '/health/')
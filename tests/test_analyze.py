@@ -0,0 +1,53 @@
+import io
+import os
+import tempfile
+from contextlib import redirect_stdout
+from django.test import SimpleTestCase
+from xff import analyze
+from xff.policy import Policy
+
+LINE = ('10.0.0.1 - - [19/Oct/2026:10:00:00 +0000] "GET %s HTTP/1.1" 200 2 '
+        '"-" "curl/8.0" "%s"\n')
+
+
+class TestAnalyze(SimpleTestCase):
+    def setUp(self):
+        log = tempfile.NamedTemporaryFile('w', suffix='.log', delete=False)
+        with log:
+            for _ in range(50):
+                log.write(LINE % ('/', '1.1.1.1, 10.0.0.2'))
+                log.write(LINE % ('/?q=1', '6.6.6.6, 1.1.1.2, 10.0.0.2'))
+                log.write(LINE % ('/health/', '-'))
+                log.write('garbage\n')
+        self.path = log.name
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_chunks_on_lines(self):
+        with open(self.path, 'rb') as log:
+            data = log.read()
+        ranges = analyze.chunks(self.path, 7)
+        self.assertEqual(0, ranges[0][1])
+        self.assertEqual(len(data), ranges[-1][2])
+        for _, start, end in ranges:
+            self.assertEqual(b'\n', data[end - 1:end])
+
+    def test_analyze(self):
+        for processes in (1, 2):
+            verdicts, clients, unparsed = analyze.analyze(
+                [self.path], Policy(depth=2, no_spoofing=True),
+                exempt_urls=[r'^health/'], processes=processes)
+            self.assertEqual(
+                {'accepted': 50, 'spoof_reject': 50, 'no_header': 50},
+                verdicts)
+            self.assertEqual({'1.1.1.1': 50}, dict(clients))
+            self.assertEqual(50, unparsed)
+
+    def test_main(self):
+        out = io.StringIO()
+        with redirect_stdout(out):
+            analyze.main([self.path, '--depth', '1', '--processes', '1'])
+        output = out.getvalue()
+        self.assertIn('spoof                       100', output)
+        self.assertIn('Distinct client addresses: 1', output)
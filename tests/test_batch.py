@@ -0,0 +1,96 @@
+import itertools
+import tracemalloc
+import unittest
+from unittest import mock
+from django.test import SimpleTestCase
+from xff import batch
+from xff.policy import ACCEPT, NO_HEADER, SPOOF, Policy
+
+HEADERS = [
+    None,
+    '',
+    '1.1.1.1',
+    '1.1.1.1, 10.0.0.1',
+    '6.6.6.6, 1.1.1.1 , 10.0.0.1',
+    '2001:db8::1, 10.0.0.1',
+    'unknown, 10.0.0.1',
+    ', '.join('10.0.0.%d' % i for i in range(60)),
+]
+EXEMPT = [i % 3 == 0 for i in range(len(HEADERS))]
+
+
+def policies():
+    flags = ('strict', 'always_proxy', 'no_spoofing', 'loose', 'stealth')
+    for depth in (0, 1, 2, 3):
+        for values in itertools.product((False, True), repeat=len(flags)):
+            yield Policy(depth=depth, **dict(zip(flags, values)))
+    yield Policy(depth=2, rewrite_remote=False)
+    yield Policy(depth=2, header_required=True)
+
+
+class TestBatch(SimpleTestCase):
+    def test_loop(self):
+        verdicts, hops, clients = batch.resolve_loop(
+            ['1.1.1.1, 10.0.0.1', None, '6.6.6.6, 1.1.1.1, 10.0.0.1'],
+            Policy(depth=2))
+        self.assertEqual([ACCEPT, NO_HEADER, SPOOF], verdicts)
+        self.assertEqual([2, 0, 3], hops)
+        self.assertEqual(['1.1.1.1', None, '1.1.1.1'],
+                         [batch.int_to_address(c) for c in clients])
+
+    def test_address_to_int(self):
+        self.assertEqual(0, batch.address_to_int('unknown'))
+        self.assertEqual('2001:db8::1', batch.int_to_address(
+            batch.address_to_int('2001:db8::1')))
+
+    @unittest.skipIf(batch.numpy is None, 'NumPy is not installed')
+    def test_numpy_matches_loop(self):
+        for policy in policies():
+            expected = batch.resolve_loop(HEADERS, policy, EXEMPT)
+            verdicts, hops, clients = batch.resolve_numpy(
+                HEADERS, policy, EXEMPT)
+            self.assertEqual(expected[0], verdicts.tolist(), vars(policy))
+            self.assertEqual(expected[1], hops.tolist())
+            self.assertEqual(
+                expected[2],
+                [int(high) << 64 | int(low) for high, low in clients],
+                vars(policy))
+
+    @unittest.skipIf(batch.numpy is None, 'NumPy is not installed')
+    def test_numpy_chunks(self):
+        headers = HEADERS * 3
+        exempt = EXEMPT * 3
+        with mock.patch.object(batch, 'CHUNK', 4), \
+                mock.patch.object(batch, 'MAX_WIDTH', 20):
+            for policy in policies():
+                verdicts, hops, clients = batch.resolve_numpy(
+                    headers, policy, exempt)
+                self.assertEqual(
+                    batch.resolve_loop(headers, policy, exempt),
+                    (verdicts.tolist(), hops.tolist(),
+                     [int(high) << 64 | int(low) for high, low in clients]),
+                    vars(policy))
+
+    @unittest.skipIf(batch.numpy is None, 'NumPy is not installed')
+    def test_numpy_overlong_header(self):
+        forged = ', '.join('10.0.%d.%d' % divmod(i, 256) for i in range(5000))
+        headers = ['1.1.1.1, 10.0.0.1'] * 2000 + [forged]
+        tracemalloc.start()
+        try:
+            verdicts, hops, clients = batch.resolve_numpy(
+                headers, Policy(depth=2))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 20 * 2 ** 20)
+        self.assertEqual([ACCEPT, SPOOF], verdicts[-2:].tolist())
+        self.assertEqual(5000, hops[-1])
+
+    def test_resolve_returns_lists(self):
+        headers = ['1.1.1.1, 10.0.0.1', None, '::1, 2.2.2.2, 10.0.0.1']
+        result = batch.resolve(headers, Policy(depth=2))
+        self.assertEqual(batch.resolve_loop(headers, Policy(depth=2)),
+                         result)
+        for values in result:
+            self.assertIs(list, type(values))
+            self.assertTrue(all(type(value) is int for value in values))
@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+from xff import bench
+
+
+class TestBench(SimpleTestCase):
+    def test_make_header(self):
+        self.assertEqual('10.0.0.0, 10.0.0.1, 10.0.0.2',
+                         bench.make_header(3))
+
+    def test_run(self):
+        results = bench.run(2, 1, 'stealth/')
+        by_name = {result['name']: result for result in results}
+        self.assertEqual(404, by_name['stealth/exempt']['status'])
+        self.assertEqual(200, by_name['stealth/hops=3']['status'])
+        self.assertEqual(5000, by_name['stealth/hops=5000']['hops'])
+        self.assertGreater(by_name['stealth/hops=3']['best_ns'], 0)
+
+    def test_compare(self):
+        old = [{'name': 'a', 'best_ns': 100}, {'name': 'b', 'best_ns': 1}]
+        new = [{'name': 'a', 'best_ns': 150}, {'name': 'c', 'best_ns': 1}]
+        self.assertEqual([('a', 100, 150, 1.5)],
+                         list(bench.compare(old, new)))
+
+
+class TestBenchCommand(SimpleTestCase):
+    def call(self, *args):
+        out = StringIO()
+        call_command('xff_bench', '--number', '2', *args, stdout=out)
+        return out.getvalue()
+
+    @override_settings(XFF_TRUSTED_PROXY_DEPTH=2, XFF_NO_SPOOFING=True)
+    def test_generated_corpus(self):
+        output = self.call()
+        self.assertIn('accepted', output)
+        self.assertIn('too_few', output)
+        self.assertIn('spoof_reject', output)
+        self.assertIn('no_header', output)
+
+    @override_settings(XFF_TRUSTED_PROXY_DEPTH=2)
+    def test_corpus_file(self):
+        with tempfile.NamedTemporaryFile('w', delete=False) as corpus:
+            corpus.write('127.0.0.1, 127.0.0.2\n')
+        try:
+            output = self.call('--corpus', corpus.name, '--path', '/health/')
+        finally:
+            os.remove(corpus.name)
+        self.assertEqual(['branch', 'exempt'],
+                         [line.split()[0] for line in output.splitlines()])
+
+    def test_no_side_effects(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        corpus = os.path.join(directory, 'corpus.txt')
+        with open(corpus, 'w') as f:
+            f.write('1.1.1.1, 10.0.0.1\n')
+        with override_settings(
+                XFF_TRUSTED_PROXY_DEPTH=2, XFF_RECORD_SIZE=10,
+                XFF_RECORD_PATH=corpus, XFF_METRICS=True,
+                XFF_METRICS_DIR=directory,
+                XFF_SNAPSHOT_PATH=os.path.join(directory, 'snapshot'),
+                XFF_THROTTLE={'path': os.path.join(directory, 'table')}):
+            self.call('--corpus', corpus)
+        self.assertEqual(['corpus.txt'], os.listdir(directory))
+        with open(corpus) as f:
+            self.assertEqual('1.1.1.1, 10.0.0.1\n', f.read())
+
+    @override_settings(XFF_CLEAN=False, XFF_REWRITE_REMOTE_ADDR=False)
+    def test_noop(self):
+        with self.assertRaises(CommandError):
+            self.call()
@@ -0,0 +1,87 @@
+import threading
+from django.test import TestCase, RequestFactory
+from django.test.utils import override_settings
+from xff import cache
+from xff.cache import DecisionCache
+from xff.middleware import XForwardedForMiddleware
+from xff.policy import ACCEPT, Decision
+from xff.views import metrics as metrics_view
+
+
+class TestDecisionCache(TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = DecisionCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(
+            {'size': 2, 'maxsize': 2, 'hits': 1, 'misses': 1,
+             'evictions': 1},
+            cache.stats())
+
+    def test_threads(self):
+        cache = DecisionCache(8)
+
+        def work(offset):
+            for i in range(20000):
+                key = (offset + i) % 16
+                if cache.get(key) is None:
+                    cache.put(key, key)
+
+        threads = [threading.Thread(target=work, args=(i,))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(8, len(cache))
+        self.assertEqual(80000, cache.hits + cache.misses)
+
+
+class TestMiddlewareCache(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def get(self, middleware, header):
+        request = self.factory.get('/', HTTP_X_FORWARDED_FOR=header)
+        middleware(request)
+        return request
+
+    @override_settings(XFF_TRUSTED_PROXY_DEPTH=2, XFF_DECISION_CACHE_SIZE=8)
+    def test_repeated_header_hits(self):
+        middleware = XForwardedForMiddleware(lambda request: None)
+        for _ in range(3):
+            request = self.get(middleware, '127.0.0.1, 127.0.0.2')
+            self.assertEqual('127.0.0.1', request.META['REMOTE_ADDR'])
+            self.assertEqual('127.0.0.1,127.0.0.2',
+                             request.META['HTTP_X_FORWARDED_FOR'])
+        self.assertEqual(1, middleware.cache.misses)
+        self.assertEqual(2, middleware.cache.hits)
+        self.assertEqual(
+            Decision(ACCEPT, 2, '127.0.0.1', '127.0.0.1,127.0.0.2'),
+            middleware.cache.get(
+                ('127.0.0.1, 127.0.0.2', False, 2, middleware.policy)))
+
+    @override_settings(XFF_TRUSTED_PROXY_DEPTH=2, XFF_DECISION_CACHE_SIZE=8)
+    def test_rebuild_expires(self):
+        middleware = XForwardedForMiddleware(lambda request: None)
+        self.get(middleware, '127.0.0.1, 127.0.0.2')
+        middleware.rebuild()
+        self.assertEqual(0, len(middleware.cache))
+
+    @override_settings(XFF_TRUSTED_PROXY_DEPTH=2, XFF_DECISION_CACHE_SIZE=1)
+    def test_metrics_view(self):
+        self.addCleanup(setattr, cache, 'decision_cache', None)
+        middleware = XForwardedForMiddleware(lambda request: None)
+        for header in ('1.1.1.1, 10.0.0.1', '1.1.1.1, 10.0.0.1', '2.2.2.2'):
+            self.get(middleware, header)
+        text = metrics_view(self.factory.get('/metrics')).content.decode()
+        self.assertIn('xff_decision_cache_hits_total 1\n', text)
+        self.assertIn('xff_decision_cache_misses_total 2\n', text)
+        self.assertIn('xff_decision_cache_evictions_total 1\n', text)
+
+    @override_settings(XFF_TRUSTED_PROXY_DEPTH=2)
+    def test_disabled_by_default(self):
+        self.assertIsNone(XForwardedForMiddleware().cache)
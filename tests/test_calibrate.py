@@ -0,0 +1,60 @@
+import json
+from django.test import SimpleTestCase, RequestFactory
+from django.test.utils import override_settings
+from xff import calibrate
+from xff.middleware import XForwardedForMiddleware
+from xff.views import calibration
+
+
+class TestDepthCalibrator(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_samples_every_interval(self):
+        calibrator = calibrate.DepthCalibrator(interval=3)
+        request = self.factory.get('/')
+        for _ in range(9):
+            calibrator.observe(request, '', 2)
+        self.assertEqual(3, calibrator.histograms[('', '')][2])
+
+    def test_recovers_from_racing_past_zero(self):
+        calibrator = calibrate.DepthCalibrator(interval=3)
+        calibrator.countdown = -1
+        calibrator.observe(self.factory.get('/'), '', 2)
+        self.assertEqual(1, calibrator.histograms[('', '')][2])
+        self.assertEqual(3, calibrator.countdown)
+
+    def test_recommend_per_prefix_and_peer(self):
+        calibrator = calibrate.DepthCalibrator(
+            interval=1, prefixes=['api/'], by_peer=True)
+        request = self.factory.get('/', REMOTE_ADDR='10.0.0.1')
+        for hops in (3, 3, 3, 4, 1):
+            calibrator.observe(request, 'api/items', hops)
+        calibrator.observe(request, 'admin/', 40)
+        self.assertEqual([
+            {'prefix': '', 'peer': '10.0.0.1', 'depth': 16, 'share': 1.0,
+             'samples': 1, 'histogram': {16: 1}},
+            {'prefix': 'api/', 'peer': '10.0.0.1', 'depth': 3, 'share': 0.6,
+             'samples': 5, 'histogram': {1: 1, 3: 3, 4: 1}},
+        ], calibrator.recommend())
+
+    def test_bounded_keys(self):
+        calibrator = calibrate.DepthCalibrator(
+            interval=1, by_peer=True, max_keys=2)
+        for i in range(5):
+            calibrator.observe(
+                self.factory.get('/', REMOTE_ADDR='10.0.0.%d' % i), '', 1)
+        self.assertEqual(2, len(calibrator.histograms))
+
+    @override_settings(XFF_TRUSTED_PROXY_DEPTH=1, XFF_CALIBRATE_INTERVAL=1)
+    def test_view(self):
+        middleware = XForwardedForMiddleware(lambda request: None)
+        for _ in range(3):
+            middleware(self.factory.get(
+                '/', HTTP_X_FORWARDED_FOR='1.1.1.1, 10.0.0.1'))
+        middleware(self.factory.get('/'))
+        response = calibration(self.factory.get('/'))
+        recommendations = json.loads(response.content)['recommendations']
+        self.assertEqual(1, len(recommendations))
+        self.assertEqual(2, recommendations[0]['depth'])
+        self.assertEqual(3, recommendations[0]['samples'])
@@ -0,0 +1,61 @@
+from django.test import SimpleTestCase, RequestFactory
+from django.test.utils import override_settings
+from django.urls import set_urlconf
+from xff.exempt import ViewExemptions
+from xff.middleware import XForwardedForMiddleware
+from tests.app.views import index
+
+
+class TestViewExemptions(SimpleTestCase):
+    def setUp(self):
+        set_urlconf(None)
+
+    def test_name(self):
+        exemptions = ViewExemptions(['health'])
+        self.assertTrue(exemptions.match('health/'))
+        self.assertFalse(exemptions.match(''))
+        self.assertFalse(exemptions.match('health/more'))
+
+    def test_namespaced_name(self):
+        exemptions = ViewExemptions(['admin:login'])
+        self.assertTrue(exemptions.match('admin/login/'))
+        self.assertFalse(exemptions.match('admin/'))
+
+    def test_namespace(self):
+        exemptions = ViewExemptions(['admin:'])
+        self.assertTrue(exemptions.match('admin/'))
+        self.assertTrue(exemptions.match('admin/auth/user/1/change/'))
+        self.assertFalse(exemptions.match('health/'))
+
+    def test_view(self):
+        for spec in (index, 'tests.app.views.index'):
+            exemptions = ViewExemptions([spec])
+            self.assertTrue(exemptions.match(''))
+            self.assertTrue(exemptions.match('health/'))
+            self.assertFalse(exemptions.match('admin/'))
+
+    def test_cached(self):
+        exemptions = ViewExemptions(['health'])
+        exemptions.match('health/')
+        exemptions.match('health/')
+        self.assertEqual(1, exemptions.cached_match.cache_info().hits)
+
+    def test_rebuilt_on_urlconf_change(self):
+        exemptions = ViewExemptions(['health'])
+        self.assertTrue(exemptions.match('health/'))
+        with override_settings(ROOT_URLCONF='tests.test_exempt'):
+            self.assertFalse(exemptions.match('health/'))
+
+    @override_settings(XFF_TRUSTED_PROXY_DEPTH=2, XFF_EXEMPT_URLS=[],
+                       XFF_EXEMPT_VIEWS=['health'], XFF_NO_SPOOFING=True)
+    def test_middleware(self):
+        middleware = XForwardedForMiddleware(lambda request: None)
+        header = '1.1.1.1, 10.0.0.1, 10.0.0.2'
+        factory = RequestFactory()
+        self.assertIsNone(middleware(
+            factory.get('/health/', HTTP_X_FORWARDED_FOR=header)))
+        self.assertEqual(400, middleware(
+            factory.get('/', HTTP_X_FORWARDED_FOR=header)).status_code)
+
+
+urlpatterns = []
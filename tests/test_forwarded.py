@@ -0,0 +1,99 @@
+import asyncio
+from django.test import AsyncRequestFactory, SimpleTestCase, RequestFactory
+from django.test.utils import override_settings
+from xff.middleware import XForwardedForMiddleware
+
+
+@override_settings(XFF_TRUSTED_PROXY_DEPTH=2,
+                   XFF_FORWARDED_HEADERS=['proto', 'host', 'port'])
+class TestForwardedHeaders(SimpleTestCase):
+    def call(self, path='/', **meta):
+        middleware = XForwardedForMiddleware(lambda request: request)
+        return middleware(RequestFactory().get(path, **meta))
+
+    def test_trusted_position(self):
+        request = self.call(
+            HTTP_X_FORWARDED_FOR='6.6.6.6, 1.1.1.1, 10.0.0.1',
+            HTTP_X_FORWARDED_PROTO='http, https, http',
+            HTTP_X_FORWARDED_HOST='evil.example, www.example.com, lb',
+            HTTP_X_FORWARDED_PORT='1, 443, 80',
+        )
+        self.assertEqual('https', request.scheme)
+        self.assertEqual('www.example.com', request.META['HTTP_HOST'])
+        self.assertEqual('443', request.META['SERVER_PORT'])
+        self.assertEqual('https,http',
+                         request.META['HTTP_X_FORWARDED_PROTO'])
+        self.assertEqual('https,http', request.headers['X-Forwarded-Proto'])
+
+    @override_settings(ALLOWED_HOSTS=['www.example.com'])
+    def test_asgi(self):
+        async def get_response(request):
+            return request
+
+        middleware = XForwardedForMiddleware(get_response)
+        request = AsyncRequestFactory().get('/', headers={
+            'X-Forwarded-For': '6.6.6.6, 1.1.1.1, 10.0.0.1',
+            'X-Forwarded-Proto': 'http, https, http',
+            'X-Forwarded-Host': 'www.example.com, lb',
+        })
+        self.assertEqual('http', request.scheme)
+        request = asyncio.run(middleware(request))
+        self.assertEqual('https', request.scheme)
+        self.assertTrue(request.is_secure())
+        self.assertEqual('https://www.example.com/',
+                         request.build_absolute_uri())
+        self.assertEqual('1.1.1.1', request.META['REMOTE_ADDR'])
+
+    def test_short_header_uses_first(self):
+        request = self.call(
+            HTTP_X_FORWARDED_FOR='1.1.1.1, 10.0.0.1',
+            HTTP_X_FORWARDED_PROTO='HTTPS',
+        )
+        self.assertEqual('https', request.scheme)
+
+    def test_invalid_values_ignored(self):
+        request = self.call(
+            HTTP_X_FORWARDED_FOR='1.1.1.1, 10.0.0.1',
+            HTTP_X_FORWARDED_PROTO='gopher, http',
+            HTTP_X_FORWARDED_PORT='x, 80',
+        )
+        self.assertEqual('http', request.scheme)
+        self.assertEqual('80', request.META['SERVER_PORT'])
+        request = self.call(
+            HTTP_X_FORWARDED_FOR='1.1.1.1, 10.0.0.1',
+            HTTP_X_FORWARDED_PROTO='gopher',
+        )
+        self.assertEqual('http', request.scheme)
+
+    def test_too_few_hops_ignored(self):
+        request = self.call(
+            HTTP_X_FORWARDED_FOR='1.1.1.1',
+            HTTP_X_FORWARDED_PROTO='https',
+            HTTP_X_FORWARDED_HOST='evil.example',
+        )
+        self.assertFalse(request.is_secure())
+        self.assertNotIn('HTTP_HOST', request.META)
+        self.assertEqual('https', request.META['HTTP_X_FORWARDED_PROTO'])
+
+    @override_settings(XFF_EXEMPT_URLS=[r'^health'])
+    def test_exempt_ignored(self):
+        request = self.call(
+            '/health/',
+            HTTP_X_FORWARDED_FOR='1.1.1.1, 10.0.0.1',
+            HTTP_X_FORWARDED_PROTO='https, https',
+        )
+        self.assertFalse(request.is_secure())
+
+    def test_needs_forwarded_for(self):
+        request = self.call(HTTP_X_FORWARDED_PROTO='https')
+        self.assertEqual('http', request.scheme)
+
+    @override_settings(XFF_FORWARDED_HEADERS=['proto'])
+    def test_only_selected(self):
+        request = self.call(
+            HTTP_X_FORWARDED_FOR='1.1.1.1, 10.0.0.1',
+            HTTP_X_FORWARDED_PROTO='https, http',
+            HTTP_X_FORWARDED_HOST='www.example.com, lb',
+        )
+        self.assertEqual('https', request.scheme)
+        self.assertNotIn('HTTP_HOST', request.META)
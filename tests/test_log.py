@@ -0,0 +1,139 @@
+import logging
+import queue
+import threading
+from unittest import mock
+from django.test import SimpleTestCase, RequestFactory
+from django.test.utils import override_settings
+from xff.log import DropOldestQueueHandler, QueueLogging, RateLimitFilter
+from xff.middleware import XForwardedForMiddleware
+from xff.views import metrics as metrics_view
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_record(msg, *args):
+    return logging.LogRecord('xff.middleware', logging.INFO, __file__, 1,
+                             msg, args, None)
+
+
+class TestRateLimitFilter(SimpleTestCase):
+    def test_limits_per_message(self):
+        clock = Clock()
+        log_filter = RateLimitFilter(2, 10, clock=clock)
+        allowed = [log_filter.filter(make_record('a %d', i))
+                   for i in range(5)]
+        self.assertEqual([True, True, False, False, False], allowed)
+        self.assertTrue(log_filter.filter(make_record('b %d', 1)))
+
+    def test_reports_suppressed(self):
+        clock = Clock()
+        log_filter = RateLimitFilter(1, 10, clock=clock)
+        for i in range(4):
+            log_filter.filter(make_record('a %d', i))
+        clock.now = 10
+        record = make_record('a %d', 9)
+        self.assertTrue(log_filter.filter(record))
+        self.assertEqual('a 9\n(3 similar messages suppressed)',
+                         record.getMessage())
+
+    def test_reports_when_period_ends(self):
+        clock = Clock()
+        logger = logging.getLogger('xff.test.ratelimit')
+        logger.propagate = False
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        log_filter = RateLimitFilter(1, 10, clock=clock, logger=logger)
+        for i in range(3):
+            log_filter.filter(make_record('a %d', i))
+        self.assertIsNotNone(log_filter.timer)
+        log_filter.cancel()
+
+        log_filter.report()
+        self.assertEqual([], records)
+        clock.now = 10
+        log_filter.report()
+        self.assertEqual(['a 2\n(2 similar messages suppressed)'],
+                         [record.getMessage() for record in records])
+        self.assertEqual(logging.INFO, records[0].levelno)
+        # already reported, not again with the next record
+        record = make_record('a %d', 3)
+        self.assertTrue(log_filter.filter(record))
+        self.assertEqual('a 3', record.getMessage())
+
+    @override_settings(XFF_LOG_RATE_LIMIT=(5, 60))
+    def test_installed_once(self):
+        XForwardedForMiddleware()
+        XForwardedForMiddleware()
+        logger = logging.getLogger('xff.middleware')
+        filters = [f for f in logger.filters
+                   if isinstance(f, RateLimitFilter)]
+        self.assertEqual(1, len(filters))
+        self.assertEqual(5, filters[0].burst)
+
+        with override_settings(XFF_LOG_RATE_LIMIT=None):
+            XForwardedForMiddleware()
+        self.assertEqual([], logger.filters)
+
+
+class TestQueueLogging(SimpleTestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('xff.test.queue')
+        self.logger.propagate = False
+        self.records = []
+        self.target = logging.Handler()
+        self.target.emit = self.records.append
+        self.logger.addHandler(self.target)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.target)
+
+    def test_ships_through_listener(self):
+        shipper = QueueLogging(self.logger, 10)
+        shipper.start()
+        self.assertIn(shipper.handler, self.logger.handlers)
+        self.assertNotIn(self.target, self.logger.handlers)
+        self.logger.warning('spoof %s', 'a')
+        shipper.stop()
+        self.assertEqual(['spoof a'],
+                         [r.getMessage() for r in self.records])
+        self.assertIn(self.target, self.logger.handlers)
+        self.assertNotIn(shipper.handler, self.logger.handlers)
+
+    def test_ships_to_ancestor_handlers(self):
+        child = logging.getLogger('xff.test.queue.child')
+        shipper = QueueLogging(child, 10)
+        shipper.start()
+        self.assertFalse(child.propagate)
+        thread = []
+        self.target.emit = lambda record: thread.append(
+            threading.current_thread())
+        child.warning('spoof')
+        shipper.stop()
+        self.assertTrue(child.propagate)
+        self.assertEqual(1, len(thread))
+        self.assertIsNot(threading.current_thread(), thread[0])
+
+    def test_dropped_in_metrics_view(self):
+        shipper = QueueLogging(self.logger, 1)
+        shipper.handler.dropped = 3
+        with mock.patch('xff.log.shipper', shipper):
+            response = metrics_view(RequestFactory().get('/metrics'))
+        self.assertIn(b'xff_log_records_dropped_total 3\n', response.content)
+
+    def test_drops_oldest(self):
+        handler = DropOldestQueueHandler(queue.Queue(2))
+        for i in range(5):
+            handler.handle(make_record('a %d', i))
+        self.assertEqual(3, handler.dropped)
+        self.assertEqual(['a 3', 'a 4'],
+                         [handler.queue.get_nowait().getMessage()
+                          for _ in range(2)])
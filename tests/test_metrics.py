@@ -0,0 +1,154 @@
+import os
+import shutil
+import tempfile
+from array import array
+from django.test import TestCase, Client, RequestFactory
+from django.test.utils import override_settings
+from xff import metrics
+from xff.middleware import XForwardedForMiddleware
+from xff.policy import ACCEPT, SPOOF, SPOOF_REJECT, STRICT_REJECT
+from xff.views import metrics as metrics_view
+
+
+class TestMetrics(TestCase):
+    def test_observe(self):
+        registry = metrics.Metrics()
+        registry.observe(ACCEPT, 2)
+        registry.observe(SPOOF_REJECT, 40)
+        text = registry.render()
+        self.assertIn('xff_requests_total{verdict="accepted"} 1\n', text)
+        self.assertIn('xff_requests_total{verdict="spoof_reject"} 1\n', text)
+        self.assertIn('xff_hops_bucket{le="1"} 0\n', text)
+        self.assertIn('xff_hops_bucket{le="2"} 1\n', text)
+        self.assertIn('xff_hops_bucket{le="15"} 1\n', text)
+        self.assertIn('xff_hops_bucket{le="+Inf"} 2\n', text)
+        self.assertIn('xff_hops_sum 42\n', text)
+        self.assertIn('xff_hops_count 2\n', text)
+
+
+class TestMiddlewareMetrics(TestCase):
+    def setUp(self):
+        metrics.registry.reset()
+
+    def tearDown(self):
+        metrics.registry.reset()
+
+    @override_settings(XFF_METRICS=True, XFF_TRUSTED_PROXY_DEPTH=2,
+                       XFF_NO_SPOOFING=True)
+    def test_counts_verdicts(self):
+        client = Client()
+        client.get('/', HTTP_X_FORWARDED_FOR='127.0.0.1, 127.0.0.2')
+        client.get('/', HTTP_X_FORWARDED_FOR='127.0.0.1, 127.0.0.2, 1.1.1.1')
+        client.get('/health/')
+        counts = metrics.registry.counts
+        self.assertEqual(1, counts[ACCEPT])
+        self.assertEqual(1, counts[SPOOF_REJECT])
+        self.assertEqual(5, counts[metrics.HOPS_SUM])
+
+        response = metrics_view(RequestFactory().get('/metrics'))
+        self.assertEqual(metrics.CONTENT_TYPE, response['Content-Type'])
+        self.assertIn(b'xff_requests_total{verdict="no_header"} 1\n',
+                      response.content)
+
+    @override_settings(XFF_TRUSTED_PROXY_DEPTH=2)
+    def test_disabled_by_default(self):
+        self.assertIsNone(XForwardedForMiddleware().metrics)
+
+
+class TestMmapMetrics(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        metrics.enable()
+        shutil.rmtree(self.directory)
+
+    def test_sums_worker_files(self):
+        registry = metrics.MmapMetrics(self.directory)
+        registry.observe(ACCEPT, 2)
+        other = array('Q', [0] * metrics.SLOTS)
+        other[ACCEPT] = 4
+        other[metrics.HOPS_SUM] = 8
+        with open(os.path.join(self.directory, 'xff-1.db'), 'wb') as db:
+            db.write(other.tobytes())
+        with open(os.path.join(self.directory, 'xff-2.db'), 'wb') as db:
+            db.write(b'\0' * 8)
+
+        counts = registry.collect()
+        self.assertEqual(5, counts[ACCEPT])
+        self.assertEqual(10, counts[metrics.HOPS_SUM])
+        self.assertIn('xff_requests_total{verdict="accepted"} 5\n',
+                      registry.render())
+
+    def test_reopen_keeps_counts(self):
+        registry = metrics.MmapMetrics(self.directory)
+        registry.observe(ACCEPT, 1)
+        registry.open()
+        self.assertEqual(1, registry.counts[ACCEPT])
+
+    def test_enable(self):
+        with override_settings(XFF_METRICS=True,
+                               XFF_METRICS_DIR=self.directory):
+            middleware = XForwardedForMiddleware()
+        self.assertIsInstance(middleware.metrics, metrics.MmapMetrics)
+        self.assertIs(metrics.registry, middleware.metrics)
+
+
+class TestShadowPolicy(TestCase):
+    def setUp(self):
+        metrics.registry.reset()
+
+    def tearDown(self):
+        metrics.registry.reset()
+
+    @override_settings(XFF_TRUSTED_PROXY_DEPTH=2, XFF_DECISION_CACHE_SIZE=8,
+                       XFF_SHADOW_POLICY={'XFF_NO_SPOOFING': True,
+                                          'XFF_ALWAYS_PROXY': True})
+    def test_counts_disagreements(self):
+        client = Client()
+        for _ in range(2):
+            response = client.get(
+                '/', HTTP_X_FORWARDED_FOR='1.1.1.1, 127.0.0.1, 127.0.0.2')
+            self.assertEqual(200, response.status_code)
+        client.get('/', HTTP_X_FORWARDED_FOR='127.0.0.1, 127.0.0.2')
+        client.get('/')
+
+        text = metrics.registry.render()
+        self.assertIn('xff_shadow_disagreements_total'
+                      '{verdict="spoof",shadow="spoof_reject"} 2\n', text)
+        self.assertIn('xff_shadow_disagreements_total'
+                      '{verdict="no_header",shadow="no_header_reject"} 1\n',
+                      text)
+        self.assertEqual(2, text.count('xff_shadow_disagreements_total{'))
+
+    @override_settings(XFF_TRUSTED_PROXY_DEPTH=2, XFF_METRICS=True,
+                       XFF_PATH_POLICIES=[('admin/', {'XFF_STRICT': True})],
+                       XFF_HOST_POLICIES={'api.example.com': {
+                           'XFF_TRUSTED_PROXY_DEPTH': 1}},
+                       XFF_SHADOW_POLICY={'XFF_NO_SPOOFING': True})
+    def test_shadow_of_routed_policy(self):
+        middleware = XForwardedForMiddleware(lambda request: None)
+        spoofed = '6.6.6.6, 1.1.1.1, 127.0.0.1'
+        middleware(RequestFactory().get(
+            '/admin/', HTTP_X_FORWARDED_FOR=spoofed))
+        self.assertEqual(1, metrics.registry.counts[STRICT_REJECT])
+        middleware(RequestFactory().get(
+            '/', HTTP_HOST='api.example.com',
+            HTTP_X_FORWARDED_FOR='1.1.1.1'))
+        self.assertEqual(0, metrics.registry.render().count(
+            'xff_shadow_disagreements_total{'))
+
+        shadow = middleware.shadows[middleware.router.lookup('admin/')]
+        self.assertTrue(shadow.strict and shadow.no_spoofing)
+        shadow = middleware.shadows[middleware.hosts['api.example.com']]
+        self.assertEqual(1, shadow.depth)
+        self.assertTrue(shadow.no_spoofing)
+
+    @override_settings(XFF_TRUSTED_PROXY_DEPTH=2,
+                       XFF_SHADOW_POLICY={'XFF_TRUSTED_PROXY_DEPTH': 3})
+    def test_shadow_depth(self):
+        middleware = XForwardedForMiddleware()
+        decision = middleware.decide(
+            middleware.policy, '1.1.1.1, 127.0.0.1, 127.0.0.2', 2, False)
+        self.assertEqual(SPOOF, decision.verdict)
+        self.assertEqual(ACCEPT, decision.shadow)
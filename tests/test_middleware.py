@@ -1,5 +1,7 @@
 from unittest.mock import patch
-from django.test import TestCase, Client
+from django.contrib.auth.models import User
+from django.core.exceptions import MiddlewareNotUsed
+from django.test import AsyncClient, TestCase, Client, RequestFactory
 from django.test.utils import override_settings
 from xff.middleware import XForwardedForMiddleware
 
@@ -198,11 +200,10 @@ class TestProxyDepth(WebTestCase):
             '/',
             HTTP_X_FORWARDED_FOR='127.0.0.1, 127.0.0.2, 127.0.0.3')
         self.assert_http_ok(response)
-        expected_message = (
-            'X-Forwarded-For spoof attempt with 3 addresses when 2 expected. '
-            'Full header: 127.0.0.1, 127.0.0.2, 127.0.0.3'
-        )
-        self.logger.info.assert_called_once_with(expected_message)
+        self.logger.info.assert_called_once_with(
+            'X-Forwarded-For spoof attempt with %d addresses when '
+            '%d expected. Full header: %s',
+            3, 2, '127.0.0.1, 127.0.0.2, 127.0.0.3')
 
 
 
@@ -341,3 +342,83 @@ class TestAlwaysProxy(WebTestCase):
             HTTP_X_FORWARDED_FOR='127.0.0.1, 127.0.0.2, 127.0.0.3')
         self.assert_http_ok(response)
         assert not self.logger.method_calls
+
+
+class TestNoop(WebTestCase):
+    def setUp(self):
+        self.patcher = patch('xff.middleware.logger', autospec=True)
+        self.logger = self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    @override_settings(XFF_CLEAN=False, XFF_REWRITE_REMOTE_ADDR=False)
+    def test_noop_is_not_used(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            XForwardedForMiddleware()
+        self.assertEqual(1, self.logger.info.call_count)
+
+    @override_settings(XFF_CLEAN=False, XFF_REWRITE_REMOTE_ADDR=False)
+    def test_noop_request_untouched(self):
+        response = Client().get(
+            '/',
+            HTTP_X_FORWARDED_FOR='127.0.0.1, 127.0.0.2',
+            REMOTE_ADDR='127.0.0.9',
+        )
+        self.assert_http_ok(response)
+        request = response.wsgi_request
+        self.assertEqual('127.0.0.9', request.META['REMOTE_ADDR'])
+        assert not self.logger.warning.called
+
+    def test_default_rewrites(self):
+        XForwardedForMiddleware()
+        assert not self.logger.method_calls
+
+    @override_settings(XFF_CLEAN=False, XFF_REWRITE_REMOTE_ADDR=False,
+                       XFF_NO_SPOOFING=True)
+    def test_flag_keeps_middleware(self):
+        XForwardedForMiddleware()
+
+    @override_settings(XFF_CLEAN=False, XFF_REWRITE_REMOTE_ADDR=False,
+                       XFF_CALIBRATE_INTERVAL=1)
+    def test_calibration_keeps_middleware(self):
+        middleware = XForwardedForMiddleware(lambda request: None)
+        request = RequestFactory().get(
+            '/', HTTP_X_FORWARDED_FOR='127.0.0.1, 127.0.0.2',
+            REMOTE_ADDR='127.0.0.9')
+        middleware(request)
+        self.assertEqual('127.0.0.9', request.META['REMOTE_ADDR'])
+        self.assertEqual(
+            2, middleware.calibrator.recommend()[0]['depth'])
+
+    @override_settings(XFF_CLEAN=False, XFF_REWRITE_REMOTE_ADDR=False,
+                       XFF_METRICS=True)
+    def test_metrics_keeps_middleware(self):
+        XForwardedForMiddleware()
+
+    @override_settings(XFF_CLEAN=False, XFF_REWRITE_REMOTE_ADDR=False)
+    def test_custom_depth_keeps_middleware(self):
+        class Custom(XForwardedForMiddleware):
+            def get_trusted_depth(self, request):
+                return 2
+
+        Custom()
+
+
+class DatabaseDepth(XForwardedForMiddleware):
+    def get_trusted_depth(self, request):
+        return User.objects.filter(is_staff=True).count()
+
+
+@override_settings(MIDDLEWARE=['tests.test_middleware.DatabaseDepth'])
+class TestAsync(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('a', 'b'):
+            User.objects.create(username=name, is_staff=True)
+
+    async def test_custom_depth_uses_orm(self):
+        response = await AsyncClient().get('/', headers={
+            'X-Forwarded-For': '6.6.6.6, 1.1.1.1, 10.0.0.1'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('1.1.1.1', response.asgi_request.META['REMOTE_ADDR'])
@@ -0,0 +1,51 @@
+from django.test import SimpleTestCase, RequestFactory
+from django.test.utils import override_settings
+from xff.middleware import XForwardedForMiddleware
+from xff.peers import PeerDepths
+
+
+class TestPeerDepths(SimpleTestCase):
+    def setUp(self):
+        self.peers = PeerDepths({
+            '10.0.0.0/8': 1,
+            '10.1.0.0/16': 2,
+            '10.1.2.3/32': 3,
+            '2001:db8::/32': 4,
+        })
+
+    def test_most_specific(self):
+        self.assertEqual(1, self.peers.lookup('10.200.0.1'))
+        self.assertEqual(2, self.peers.lookup('10.1.0.1'))
+        self.assertEqual(3, self.peers.lookup('10.1.2.3'))
+        self.assertEqual(4, self.peers.lookup('2001:db8::1'))
+
+    def test_no_match(self):
+        self.assertIsNone(self.peers.lookup('192.0.2.1'))
+        self.assertIsNone(self.peers.lookup('2001:db9::1'))
+        self.assertIsNone(self.peers.lookup(''))
+
+    def test_cached(self):
+        self.peers.lookup('10.1.0.1')
+        self.peers.lookup('10.1.0.1')
+        self.assertEqual(1, self.peers.lookup.cache_info().hits)
+
+
+@override_settings(XFF_TRUSTED_PROXY_DEPTH=1,
+                   XFF_PEER_DEPTHS={'192.0.2.0/24': 2})
+class TestMiddlewarePeerDepths(SimpleTestCase):
+    def call(self, peer):
+        middleware = XForwardedForMiddleware(lambda request: None)
+        request = RequestFactory().get(
+            '/', REMOTE_ADDR=peer,
+            HTTP_X_FORWARDED_FOR='1.1.1.1, 10.0.0.1')
+        middleware(request)
+        self.assertEqual(middleware.get_trusted_depth(
+            RequestFactory().get('/', REMOTE_ADDR=peer)),
+            2 if peer.startswith('192.0.2.') else 1)
+        return request.META['REMOTE_ADDR']
+
+    def test_peer_depth(self):
+        self.assertEqual('1.1.1.1', self.call('192.0.2.10'))
+
+    def test_policy_depth(self):
+        self.assertEqual('10.0.0.1', self.call('198.51.100.1'))
@@ -0,0 +1,82 @@
+import ipaddress
+import os
+import shutil
+import tempfile
+from unittest import mock
+from django.test import SimpleTestCase, RequestFactory
+from django.test.utils import override_settings
+from xff.middleware import XForwardedForMiddleware
+from xff.recorder import HeaderRecorder
+
+
+class TestHeaderRecorder(SimpleTestCase):
+    def test_fills_then_samples(self):
+        recorder = HeaderRecorder(10)
+        for i in range(1000):
+            recorder.record(str(i))
+        self.assertEqual(1000, recorder.seen)
+        self.assertEqual(10, len(recorder.sample))
+        self.assertGreater(max(int(header) for header in recorder.sample),
+                           10)
+
+    def test_anonymize_keeps_shape(self):
+        recorder = HeaderRecorder(10, anonymize=True)
+        anonymized = recorder.anonymized('1.2.3.4, ::1,unknown,1.2.3.4')
+        parts = anonymized.split(',')
+        self.assertEqual(4, len(parts))
+        self.assertTrue(parts[1].startswith(' '))
+        self.assertEqual(4, ipaddress.ip_address(parts[0]).version)
+        self.assertEqual(6, ipaddress.ip_address(parts[1].strip()).version)
+        self.assertEqual('invalid', parts[2])
+        self.assertEqual(parts[0], parts[3])
+        self.assertNotEqual('1.2.3.4', parts[0])
+
+    def test_flush(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'corpus.txt')
+        recorder = HeaderRecorder(2, path)
+        recorder.record('1.1.1.1, 2.2.2.2')
+        recorder.flush()
+        with open(path) as corpus:
+            self.assertEqual('1.1.1.1, 2.2.2.2\n', corpus.read())
+        os.remove(path)
+        os.rmdir(directory)
+
+    def test_flush_error_logged(self):
+        recorder = HeaderRecorder(2, '/nonexistent/corpus.txt')
+        recorder.record('1.1.1.1')
+        with self.assertLogs('xff.recorder', 'WARNING'):
+            recorder.flush()
+
+    def test_periodic_flush_in_background(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'corpus.txt')
+        recorder = HeaderRecorder(2, path, interval=0.001)
+        recorder.next_flush = 0
+        recorder.next_check = 1
+        with mock.patch('xff.recorder.threading.Thread') as thread:
+            recorder.record('1.1.1.1')
+        thread.assert_called_once_with(target=recorder.flush, daemon=True)
+        thread.return_value.start.assert_called_once_with()
+        self.assertFalse(os.path.exists(path))
+
+    @override_settings(XFF_CLEAN=False, XFF_REWRITE_REMOTE_ADDR=False,
+                       XFF_RECORD_SIZE=5)
+    def test_recording_keeps_middleware(self):
+        with mock.patch('xff.recorder.atexit.register') as register:
+            middleware = XForwardedForMiddleware(lambda request: None)
+        register.assert_called_once_with(middleware.recorder.flush)
+        request = RequestFactory().get(
+            '/', HTTP_X_FORWARDED_FOR='1.1.1.1', REMOTE_ADDR='10.0.0.1')
+        middleware(request)
+        self.assertEqual(['1.1.1.1'], middleware.recorder.sample)
+        self.assertEqual('10.0.0.1', request.META['REMOTE_ADDR'])
+
+    @override_settings(XFF_TRUSTED_PROXY_DEPTH=1, XFF_RECORD_SIZE=5)
+    def test_middleware_records(self):
+        middleware = XForwardedForMiddleware(lambda request: None)
+        middleware(RequestFactory().get(
+            '/', HTTP_X_FORWARDED_FOR='1.1.1.1, 2.2.2.2'))
+        middleware(RequestFactory().get('/'))
+        self.assertEqual(['1.1.1.1, 2.2.2.2'], middleware.recorder.sample)
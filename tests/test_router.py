@@ -0,0 +1,87 @@
+from django.test import SimpleTestCase, RequestFactory
+from django.test.utils import override_settings
+from xff.middleware import XForwardedForMiddleware
+from xff.router import PrefixRouter
+
+
+class TestPrefixRouter(SimpleTestCase):
+    def test_longest_prefix(self):
+        router = PrefixRouter([('api/', 1), ('api/v2/', 2), ('admin', 3)],
+                              'default')
+        self.assertEqual(1, router.lookup('api/items'))
+        self.assertEqual(2, router.lookup('api/v2/items'))
+        self.assertEqual(1, router.lookup('api/v'))
+        self.assertEqual(3, router.lookup('admin/'))
+        self.assertEqual('default', router.lookup('ap'))
+        self.assertEqual('default', router.lookup(''))
+        self.assertEqual([1, 2, 3], sorted(router.values()))
+
+    def test_empty_prefix(self):
+        router = PrefixRouter([('', 1)], 'default')
+        self.assertEqual(1, router.lookup('anything'))
+
+
+@override_settings(
+    XFF_TRUSTED_PROXY_DEPTH=1,
+    XFF_PATH_POLICIES=[
+        ('api/', {'XFF_TRUSTED_PROXY_DEPTH': 3}),
+        ('admin/', {'XFF_TRUSTED_PROXY_DEPTH': 2, 'XFF_STRICT': True}),
+    ],
+)
+class TestPathPolicies(SimpleTestCase):
+    def call(self, path, header):
+        middleware = XForwardedForMiddleware(lambda request: None)
+        request = RequestFactory().get(path, HTTP_X_FORWARDED_FOR=header)
+        response = middleware(request)
+        return request, response
+
+    def test_default(self):
+        request, _ = self.call('/', '1.1.1.1, 10.0.0.1, 10.0.0.2')
+        self.assertEqual('10.0.0.2', request.META['REMOTE_ADDR'])
+
+    def test_prefix_depth(self):
+        request, _ = self.call('/api/items', '1.1.1.1, 10.0.0.1, 10.0.0.2')
+        self.assertEqual('1.1.1.1', request.META['REMOTE_ADDR'])
+
+    def test_prefix_flags(self):
+        _, response = self.call('/admin/', '1.1.1.1, 10.0.0.1, 10.0.0.2')
+        self.assertEqual(400, response.status_code)
+
+    def test_trusted_depth(self):
+        middleware = XForwardedForMiddleware()
+        request = RequestFactory().get('/api/')
+        self.assertEqual(3, middleware.get_trusted_depth(request))
+
+
+@override_settings(
+    XFF_TRUSTED_PROXY_DEPTH=1,
+    XFF_HOST_POLICIES={
+        'api.example.com': {'XFF_TRUSTED_PROXY_DEPTH': 3},
+    },
+    XFF_PATH_POLICIES=[('admin/', {'XFF_TRUSTED_PROXY_DEPTH': 2})],
+)
+class TestHostPolicies(SimpleTestCase):
+    def depth(self, path, host):
+        middleware = XForwardedForMiddleware()
+        return middleware.get_trusted_depth(
+            RequestFactory().get(path, HTTP_HOST=host))
+
+    def test_host(self):
+        self.assertEqual(3, self.depth('/', 'api.example.com'))
+
+    def test_host_with_port(self):
+        self.assertEqual(3, self.depth('/', 'API.example.com:8443'))
+
+    def test_fallback(self):
+        self.assertEqual(1, self.depth('/', 'www.example.com'))
+
+    def test_path_first(self):
+        self.assertEqual(2, self.depth('/admin/', 'api.example.com'))
+
+    def test_rewrites(self):
+        middleware = XForwardedForMiddleware(lambda request: None)
+        request = RequestFactory().get(
+            '/', HTTP_HOST='api.example.com',
+            HTTP_X_FORWARDED_FOR='1.1.1.1, 10.0.0.1, 10.0.0.2')
+        middleware(request)
+        self.assertEqual('1.1.1.1', request.META['REMOTE_ADDR'])
@@ -0,0 +1,90 @@
+from django.test import SimpleTestCase, RequestFactory
+from django.test.utils import override_settings
+from xff import metrics
+from xff.middleware import XForwardedForMiddleware
+from xff.policy import SHED
+from xff.shed import LoadShedder
+
+SPOOFED = '6.6.6.6, 1.1.1.1, 10.0.0.1'
+GOOD = '1.1.1.1, 10.0.0.1'
+
+
+class TestLoadShedder(SimpleTestCase):
+    def test_needs_full_window(self):
+        shedder = LoadShedder(threshold=0.5, window=16)
+        for _ in range(14):
+            shedder.observe(True)
+        self.assertFalse(shedder.shedding)
+        with self.assertLogs('xff.shed', 'WARNING') as logs:
+            shedder.observe(True)
+            shedder.observe(True)
+        self.assertTrue(shedder.shedding)
+        self.assertEqual(1, len(logs.output))
+        self.assertIn('load shedding on: 100% of the last 16', logs.output[0])
+
+    def test_hysteresis(self):
+        shedder = LoadShedder(threshold=0.5, window=8)
+        with self.assertLogs('xff.shed', 'WARNING') as logs:
+            for bad in [True] * 8 + [False] * 6:
+                shedder.observe(bad)
+            self.assertTrue(shedder.shedding)
+            shedder.observe(False)
+            self.assertFalse(shedder.shedding)
+        self.assertEqual(2, len(logs.output))
+        self.assertIn('load shedding off: 12%', logs.output[1])
+
+
+@override_settings(XFF_TRUSTED_PROXY_DEPTH=2, XFF_METRICS=True,
+                   XFF_SHED={'threshold': 0.5, 'window': 8},
+                   XFF_EXEMPT_URLS=[r'^health'])
+class TestMiddlewareShedding(SimpleTestCase):
+    def setUp(self):
+        metrics.registry.reset()
+        self.middleware = XForwardedForMiddleware(lambda request: None)
+
+    def tearDown(self):
+        metrics.registry.reset()
+
+    def call(self, header, path='/'):
+        extra = {'HTTP_X_FORWARDED_FOR': header} if header else {}
+        response = self.middleware(RequestFactory().get(path, **extra))
+        return response.status_code if response else 200
+
+    def test_flood(self):
+        with self.assertLogs('xff', 'INFO') as logs:
+            for _ in range(8):
+                self.assertEqual(200, self.call(SPOOFED))
+        self.assertEqual(9, len(logs.output))
+        self.assertTrue(self.middleware.shedder.shedding)
+
+        with self.assertNoLogs('xff', 'INFO'):
+            self.assertEqual(400, self.call(SPOOFED))
+            self.assertEqual(400, self.call('1.1.1.1'))
+            self.assertEqual(200, self.call(None))
+            self.assertEqual(200, self.call(SPOOFED, '/health/'))
+            self.assertEqual(200, self.call(GOOD))
+        self.assertEqual(2, metrics.registry.counts[SHED])
+
+        with self.assertLogs('xff.shed', 'WARNING'):
+            for _ in range(6):
+                self.call(GOOD)
+        self.assertFalse(self.middleware.shedder.shedding)
+        self.assertEqual(200, self.call(SPOOFED))
+
+    def test_recovers_with_headerless_traffic(self):
+        with self.assertLogs('xff', 'INFO'):
+            for _ in range(8):
+                self.call(SPOOFED)
+        self.assertTrue(self.middleware.shedder.shedding)
+        with self.assertLogs('xff.shed', 'WARNING'):
+            statuses = [self.call(None if i % 5 < 2 else GOOD)
+                        for i in range(20)]
+        self.assertEqual([200] * 20, statuses)
+        self.assertFalse(self.middleware.shedder.shedding)
+
+    @override_settings(XFF_LOOSE_UNSAFE=True)
+    def test_loose_not_shed(self):
+        middleware = XForwardedForMiddleware(lambda request: None)
+        middleware.shedder.shedding = True
+        self.middleware = middleware
+        self.assertEqual(200, self.call(SPOOFED))
@@ -0,0 +1,186 @@
+import atexit
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import unittest
+import warnings
+from unittest import mock
+from django.test import SimpleTestCase, RequestFactory
+from django.test.utils import override_settings
+from xff import snapshot
+from xff.metrics import MAX_HOPS
+from xff.middleware import XForwardedForMiddleware
+from xff.throttle import TokenBuckets
+
+SPOOFED = '6.6.6.6, 1.1.1.1, 10.0.0.1'
+
+
+class TestSnapshot(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'xff.snapshot')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        histogram = list(range(MAX_HOPS + 1))
+        state = {
+            'buckets': [('1.1.1.1', 0.5), ('::1', 3.0)],
+            'histograms': {('api/', '10.0.0.1'): histogram},
+            'hot': [(0, False, 2, SPOOFED), (1, True, 0, 'ünïcode')],
+        }
+        snapshot.write(self.path, state)
+        read = snapshot.read(self.path)
+        self.assertLess(read.pop('age'), 60)
+        self.assertEqual(state, read)
+        self.assertEqual([], os.listdir(self.directory)[1:])
+
+    def test_skips_unknown_sections(self):
+        snapshot.write(self.path, {'buckets': [('a', 1.0)]})
+        with open(self.path, 'rb') as f:
+            data = bytearray(f.read())
+        start = snapshot.HEADER.size
+        data[start:start + 4] = b'NEW!'
+        with open(self.path, 'wb') as f:
+            f.write(data)
+        self.assertEqual({'age'}, set(snapshot.read(self.path)))
+
+    def test_invalid(self):
+        snapshot.write(self.path, {'buckets': [('a', 1.0)]})
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        for broken in (b'', b'garbage', data[:-3],
+                       data.replace(b'XFFSNAP', b'XFFSNAQ')):
+            with open(self.path, 'wb') as f:
+                f.write(broken)
+            with self.assertRaises(snapshot.SnapshotError):
+                snapshot.read(self.path)
+
+    def test_load_buckets(self):
+        now = [100.0]
+        buckets = TokenBuckets(rate=1, burst=2, size=2,
+                               clock=lambda: now[0])
+        buckets.allow('new')
+        buckets.load([('a', 0.0), ('b', 0.0), ('new', 2.0)], age=0.5)
+        self.assertEqual(['b', 'new'], list(buckets.buckets))
+        self.assertTrue(buckets.blocked('b'))
+        self.assertEqual(1.0, buckets.tokens('new', now[0]))
+        now[0] += 0.5
+        self.assertFalse(buckets.blocked('b'))
+
+
+@override_settings(
+    XFF_TRUSTED_PROXY_DEPTH=2,
+    XFF_THROTTLE={'rate': 0.001, 'burst': 1},
+    XFF_CALIBRATE_INTERVAL=1,
+    XFF_DECISION_CACHE_SIZE=10,
+)
+class TestMiddlewareSnapshot(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'xff.snapshot')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def middleware(self, interval=60):
+        with override_settings(XFF_SNAPSHOT_PATH=self.path,
+                               XFF_SNAPSHOT_INTERVAL=interval):
+            middleware = XForwardedForMiddleware(lambda request: None)
+        self.addCleanup(atexit.unregister, middleware.stop_snapshots)
+        self.addCleanup(middleware.snapshots_stopped.set)
+        return middleware
+
+    def call(self, middleware, header):
+        response = middleware(RequestFactory().get(
+            '/', HTTP_X_FORWARDED_FOR=header))
+        return response.status_code if response else 200
+
+    def test_warm_start(self):
+        first = self.middleware()
+        self.assertEqual(200, self.call(first, SPOOFED))
+        first.save_snapshot()
+
+        second = self.middleware()
+        self.assertEqual(1, len(second.cache))
+        self.assertEqual({('', ''): [0, 0, 0, 1] + [0] * (MAX_HOPS - 3)},
+                         second.calibrator.histograms)
+        self.assertEqual(400, self.call(second, SPOOFED))
+        self.assertEqual(1, second.cache.hits)
+
+    def test_periodic(self):
+        middleware = self.middleware(interval=0.01)
+        with mock.patch.object(middleware, 'save_snapshot') as save:
+            saved = threading.Event()
+            save.side_effect = saved.set
+            self.call(middleware, '1.1.1.1, 10.0.0.1')
+            self.assertTrue(saved.wait(5))
+
+    def test_stop(self):
+        middleware = self.middleware()
+        self.call(middleware, '1.1.1.1, 10.0.0.1')
+        middleware.stop_snapshots()
+        self.assertTrue(middleware.snapshots_stopped.is_set())
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_unserved_does_not_write(self):
+        middleware = self.middleware()
+        middleware.save_snapshot()
+        self.assertFalse(os.path.exists(self.path))
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs fork()')
+    def test_preforked_workers(self):
+        parent = self.middleware()
+
+        def fork(work):
+            pid = os.fork()
+            if not pid:
+                code = 1
+                try:
+                    code = work()
+                finally:
+                    os._exit(code)
+            return os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1])
+
+        def first():
+            for i in range(5):
+                self.call(parent, '6.6.6.%d' % i)
+            parent.save_snapshot()
+            return 0
+
+        def second():
+            return len(parent.throttle.buckets)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)
+            self.assertEqual(0, fork(first))
+            parent.save_snapshot()
+            self.assertEqual(5, len(snapshot.read(self.path)['buckets']))
+            self.assertEqual(5, fork(second))
+
+    def test_long_key(self):
+        middleware = self.middleware()
+        # too few entries, keyed by the client controlled first entry
+        self.assertEqual(200, self.call(middleware, 'x' * 70000))
+        middleware.save_snapshot()
+        state = snapshot.read(self.path)
+        self.assertEqual(['x' * 70000],
+                         [key for key, _ in state['buckets']])
+
+    def test_write_error_logged(self):
+        middleware = self.middleware()
+        self.call(middleware, '1.1.1.1, 10.0.0.1')
+        with mock.patch('xff.snapshot.write',
+                        side_effect=struct.error('too long')), \
+                self.assertLogs('xff.middleware', 'WARNING'):
+            middleware.save_snapshot()
+
+    def test_invalid_snapshot(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'garbage')
+        with self.assertLogs('xff.middleware', 'WARNING'):
+            middleware = self.middleware()
+        self.assertEqual(0, len(middleware.cache))
@@ -0,0 +1,269 @@
+import asyncio
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from asgiref.sync import iscoroutinefunction
+from django.http import HttpResponse
+from django.test import SimpleTestCase, RequestFactory
+from django.test.utils import override_settings
+from xff import metrics
+from xff.middleware import XForwardedForMiddleware
+from xff.policy import THROTTLED
+from xff.throttle import SharedTokenBuckets, TokenBuckets
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBuckets(SimpleTestCase):
+    def test_refills(self):
+        clock = Clock()
+        buckets = TokenBuckets(rate=1, burst=2, clock=clock)
+        self.assertEqual([True, True, False],
+                         [buckets.allow('a') for _ in range(3)])
+        self.assertTrue(buckets.blocked('a'))
+        self.assertFalse(buckets.blocked('b'))
+        clock.now = 1
+        self.assertFalse(buckets.blocked('a'))
+        self.assertTrue(buckets.allow('a'))
+        self.assertFalse(buckets.allow('a'))
+
+    def test_bounded(self):
+        buckets = TokenBuckets(size=3)
+        for key in 'abcde':
+            buckets.allow(key)
+        self.assertEqual(['c', 'd', 'e'], list(buckets.buckets))
+        buckets.allow('c')
+        buckets.allow('f')
+        self.assertEqual(['e', 'c', 'f'], list(buckets.buckets))
+
+    def test_threads(self):
+        buckets = TokenBuckets(rate=0, burst=1000000, size=8)
+
+        def work(offset):
+            for i in range(20000):
+                buckets.allow((offset + i) % 16)
+
+        threads = [threading.Thread(target=work, args=(i,))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(8, len(buckets.buckets))
+
+
+SPOOFED = '6.6.6.6, 1.1.1.1, 10.0.0.1'
+
+
+@override_settings(XFF_TRUSTED_PROXY_DEPTH=2, XFF_METRICS=True)
+class TestMiddlewareThrottle(SimpleTestCase):
+    def setUp(self):
+        metrics.registry.reset()
+
+    def tearDown(self):
+        metrics.registry.reset()
+
+    def statuses(self, headers, peer='10.0.0.9'):
+        middleware = self.middleware = XForwardedForMiddleware(
+            lambda request: None)
+        factory = RequestFactory()
+        statuses = []
+        for header in headers:
+            response = middleware(factory.get(
+                '/', REMOTE_ADDR=peer, HTTP_X_FORWARDED_FOR=header))
+            statuses.append(response.status_code if response else 200)
+        return statuses
+
+    @override_settings(XFF_THROTTLE={'rate': 0.001, 'burst': 2})
+    def test_client(self):
+        self.assertEqual(
+            [200, 200, 400, 200, 200],
+            self.statuses([SPOOFED, SPOOFED, SPOOFED,
+                           '1.1.1.1, 10.0.0.1', '7.7.7.7, 2.2.2.2, 10.0.0.1']))
+        self.assertEqual(1, metrics.registry.counts[THROTTLED])
+
+    @override_settings(XFF_THROTTLE={'rate': 0.001, 'burst': 1},
+                       XFF_NO_SPOOFING=True)
+    def test_rejected_keyed_by_client(self):
+        # Offenders behind the same load balancer get their own buckets
+        self.assertEqual(
+            [400, 400, 400, 400],
+            self.statuses([SPOOFED, '7.7.7.7, 2.2.2.2, 10.0.0.1',
+                           SPOOFED, '7.7.7.7, 2.2.2.2, 10.0.0.1']))
+        self.assertEqual(['1.1.1.1', '2.2.2.2'],
+                         sorted(self.middleware.throttle.buckets))
+        self.assertEqual(2, metrics.registry.counts[THROTTLED])
+
+    @override_settings(XFF_THROTTLE={'rate': 0.001, 'burst': 1,
+                                     'key': 'peer'})
+    def test_peer(self):
+        self.assertEqual(
+            [200, 400, 400],
+            self.statuses([SPOOFED, SPOOFED, '1.1.1.1, 10.0.0.1']))
+        self.assertEqual(2, metrics.registry.counts[THROTTLED])
+
+    def test_shared(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        throttle = {'rate': 0.001, 'burst': 2,
+                    'path': os.path.join(directory, 'offenders')}
+        with override_settings(XFF_THROTTLE=throttle):
+            self.assertEqual([200, 200], self.statuses([SPOOFED, SPOOFED]))
+            # a new middleware, like one in another worker, sees the buckets
+            self.assertEqual([400], self.statuses([SPOOFED]))
+
+    def test_shared_async_off_loop(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        throttle = {'rate': 0.001, 'burst': 1,
+                    'path': os.path.join(directory, 'offenders')}
+
+        async def get_response(request):
+            return HttpResponse()
+
+        with override_settings(XFF_THROTTLE=throttle):
+            middleware = XForwardedForMiddleware(get_response)
+        threads = []
+        check = middleware.check
+
+        def record(request):
+            threads.append(threading.current_thread())
+            return check(request)
+        middleware.check = record
+
+        async def run():
+            return [(await middleware(RequestFactory().get(
+                '/', HTTP_X_FORWARDED_FOR=SPOOFED))).status_code
+                for _ in range(2)]
+
+        self.assertEqual([200, 400], asyncio.run(run()))
+        self.assertNotIn(threading.main_thread(), threads)
+
+
+@override_settings(XFF_TRUSTED_PROXY_DEPTH=2,
+                   XFF_THROTTLE={'rate': 0.001, 'burst': 1},
+                   XFF_TARPIT_DELAY=0.01, XFF_TARPIT_MAX=1)
+class TestTarpit(SimpleTestCase):
+    def request(self, header=SPOOFED):
+        return RequestFactory().get('/', HTTP_X_FORWARDED_FOR=header)
+
+    def test_async(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        middleware = XForwardedForMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+
+        async def run():
+            first = await middleware(self.request())
+            held = asyncio.ensure_future(middleware(self.request()))
+            await asyncio.sleep(0)
+            self.assertEqual(1, middleware.tarpitted)
+            # over XFF_TARPIT_MAX, answered at once
+            immediate = await middleware(self.request())
+            self.assertFalse(held.done())
+            good = await middleware(self.request('1.1.1.1, 10.0.0.1'))
+            return first, await held, immediate, good
+
+        statuses = [response.status_code
+                    for response in asyncio.run(run())]
+        self.assertEqual([200, 400, 400, 200], statuses)
+        self.assertEqual(0, middleware.tarpitted)
+
+    @override_settings(XFF_TARPIT_DELAY=60)
+    def test_sync_not_delayed(self):
+        middleware = XForwardedForMiddleware(lambda request: HttpResponse())
+        self.assertFalse(iscoroutinefunction(middleware))
+        middleware(self.request())
+        start = time.monotonic()
+        self.assertEqual(400, middleware(self.request()).status_code)
+        self.assertLess(time.monotonic() - start, 30)
+
+
+class TestSharedTokenBuckets(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'offenders')
+        self.clock = Clock()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def buckets(self, **kwargs):
+        kwargs.setdefault('clock', self.clock)
+        return SharedTokenBuckets(self.path, **kwargs)
+
+    def test_refills(self):
+        buckets = self.buckets(rate=1, burst=2)
+        self.assertEqual([True, True, False],
+                         [buckets.allow('a') for _ in range(3)])
+        self.assertTrue(buckets.blocked('a'))
+        self.assertFalse(buckets.blocked('b'))
+        self.clock.now = 1
+        self.assertTrue(buckets.allow('a'))
+
+    def test_shared_between_tables(self):
+        first = self.buckets(rate=0, burst=1)
+        second = self.buckets(rate=0, burst=1, size=5)
+        self.assertEqual(first.size, second.size)
+        self.assertTrue(first.allow('a'))
+        self.assertFalse(second.allow('a'))
+
+    def test_replaces_oldest(self):
+        buckets = self.buckets(rate=0, burst=1, size=1)
+        for i in range(buckets.PROBES + 1):
+            self.clock.now = i
+            self.assertTrue(buckets.allow(i))
+        self.assertFalse(buckets.blocked(0))
+        self.assertTrue(buckets.blocked(buckets.PROBES))
+
+    def test_stripes(self):
+        buckets = self.buckets()
+        self.assertEqual(1, len(buckets.stripes(0)))
+        self.assertEqual(2, len(buckets.stripes(1)))
+        # overlapping slot ranges always share a lock
+        for home in range(200):
+            for other in range(home, home + buckets.PROBES):
+                self.assertTrue(set(map(id, buckets.stripes(home))) &
+                                set(map(id, buckets.stripes(other))))
+
+    def test_threads(self):
+        buckets = self.buckets(rate=0, burst=10 ** 6)
+
+        def work():
+            for i in range(2000):
+                buckets.allow(i % 50)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(10 ** 6 - 160, buckets.tokens(
+            *buckets.find(buckets.hash(0)), self.clock()))
+
+    def test_not_a_table(self):
+        with open(self.path, 'wb') as table:
+            table.write(b'\0' * 64)
+        with self.assertRaises(ValueError):
+            self.buckets()
+
+    def test_across_processes(self):
+        buckets = self.buckets(rate=0, burst=100, clock=time.time)
+        with multiprocessing.get_context('fork').Pool(4) as pool:
+            pool.map(take, [self.path] * 40)
+        self.assertEqual(40, sum(
+            not buckets.allow('shared') for _ in range(100)))
+
+
+def take(path):
+    SharedTokenBuckets(path, rate=0, burst=100).allow('shared')
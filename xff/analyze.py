@@ -0,0 +1,193 @@
+'''
+Replay access logs through the XFF decision.
+
+Streams the X-Forwarded-For values out of access logs and counts what
+the given policy would decide for each request:
+
+    python -m xff.analyze --depth 2 --no-spoofing access.log.1 access.log
+
+Files are memory-mapped and split into chunks at line boundaries that a
+pool of processes works through, so files of any size can be analyzed.
+'''
+import argparse
+import json
+import mmap
+import multiprocessing
+import os
+import re
+import sys
+from collections import Counter
+
+from .policy import VERDICTS, Policy
+
+FORMATS = {
+    # combined log format with "$http_x_forwarded_for" as the last field
+    'nginx': r'"[A-Z]+ (?P<path>\S+)[^"]*" .*"(?P<xff>[^"]*)"\s*$',
+    # only the header value on each line
+    'raw': r'(?P<xff>.*)',
+}
+
+# Values that loggers write for a missing header
+MISSING = ('', '-')
+
+
+def chunks(path, count):
+    '''
+    Split path into about count (start, end) byte ranges on line
+    boundaries.
+    '''
+    size = os.path.getsize(path)
+    if not size:
+        return []
+    with open(path, 'rb') as log, \
+            mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        bounds = [0]
+        for i in range(1, count):
+            end = data.find(b'\n', size * i // count)
+            if end == -1:
+                break
+            if end + 1 > bounds[-1]:
+                bounds.append(end + 1)
+        bounds.append(size)
+    return [(path, start, end) for start, end in zip(bounds, bounds[1:])
+            if end > start]
+
+
+def analyze_chunk(args):
+    '''
+    Verdict and client address counts of one chunk of a log file.
+    '''
+    (path, start, end), pattern, policy, exempt_urls = args
+    matcher = re.compile(pattern).search
+    exempt_urls = [re.compile(expr) for expr in exempt_urls]
+    verdicts = Counter()
+    clients = Counter()
+    unparsed = 0
+    depth = policy.depth
+
+    with open(path, 'rb') as log, \
+            mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        data.seek(start)
+        while data.tell() < end:
+            line = data.readline().decode('latin-1')
+            match = matcher(line)
+            if match is None:
+                unparsed += 1
+                continue
+            groups = match.groupdict()
+            path_info = (groups.get('path') or '/').split('?', 1)[0]
+            exempt = any(m.match(path_info.lstrip('/'))
+                         for m in exempt_urls)
+            header = groups['xff'].strip()
+            if header in MISSING:
+                decision = policy.decide_missing(exempt)
+            else:
+                decision = policy.decide(header, depth, exempt)
+            verdicts[decision.verdict] += 1
+            if decision.client is not None:
+                clients[decision.client] += 1
+
+    return verdicts, clients, unparsed
+
+
+def analyze(paths, policy, pattern=FORMATS['nginx'], exempt_urls=(),
+            processes=None):
+    '''
+    Returns (verdict name counts, client counts, unparsed line count).
+    '''
+    processes = processes or os.cpu_count() or 1
+    work = [(chunk, pattern, policy, list(exempt_urls))
+            for path in paths for chunk in chunks(path, processes * 4)]
+
+    verdicts = Counter()
+    clients = Counter()
+    unparsed = 0
+    if processes == 1:
+        results = map(analyze_chunk, work)
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(analyze_chunk, work)
+    try:
+        for chunk_verdicts, chunk_clients, chunk_unparsed in results:
+            verdicts.update(chunk_verdicts)
+            clients.update(chunk_clients)
+            unparsed += chunk_unparsed
+    finally:
+        if processes != 1:
+            pool.close()
+            pool.join()
+
+    return ({VERDICTS[verdict]: count
+             for verdict, count in sorted(verdicts.items())},
+            clients, unparsed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m xff.analyze', description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('logs', nargs='+', help='access log files')
+    parser.add_argument('--depth', type=int, default=0,
+                        help='XFF_TRUSTED_PROXY_DEPTH')
+    parser.add_argument('--strict', action='store_true', help='XFF_STRICT')
+    parser.add_argument('--always-proxy', action='store_true',
+                        help='XFF_ALWAYS_PROXY')
+    parser.add_argument('--no-spoofing', action='store_true',
+                        help='XFF_NO_SPOOFING')
+    parser.add_argument('--header-required', choices=('true', 'false'),
+                        help='XFF_HEADER_REQUIRED')
+    parser.add_argument('--loose', action='store_true',
+                        help='XFF_LOOSE_UNSAFE')
+    parser.add_argument('--stealth', action='store_true',
+                        help='XFF_EXEMPT_STEALTH')
+    parser.add_argument('--exempt', action='append', default=[],
+                        metavar='REGEX', help='XFF_EXEMPT_URLS entry')
+    parser.add_argument('--format', choices=sorted(FORMATS),
+                        default='nginx', help='log line format')
+    parser.add_argument('--pattern',
+                        help='regular expression with an xff and an '
+                             'optional path group, overrides --format')
+    parser.add_argument('--processes', type=int,
+                        help='worker processes (default: CPU count)')
+    parser.add_argument('--top', type=int, default=20,
+                        help='most common client addresses to list')
+    parser.add_argument('--json', action='store_true',
+                        help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    header_required = None
+    if args.header_required:
+        header_required = args.header_required == 'true'
+    policy = Policy(
+        depth=args.depth, strict=args.strict,
+        always_proxy=args.always_proxy, no_spoofing=args.no_spoofing,
+        header_required=header_required, loose=args.loose,
+        stealth=args.stealth,
+    )
+
+    verdicts, clients, unparsed = analyze(
+        args.logs, policy, args.pattern or FORMATS[args.format],
+        args.exempt, args.processes)
+
+    report = {
+        'verdicts': verdicts,
+        'unparsed': unparsed,
+        'clients': len(clients),
+        'top_clients': clients.most_common(args.top),
+    }
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return
+
+    print('Verdicts:')
+    for name, count in verdicts.items():
+        print('  %-18s %12d' % (name, count))
+    print('  %-18s %12d' % ('unparsed lines', unparsed))
+    print('Distinct client addresses: %d' % len(clients))
+    for client, count in report['top_clients']:
+        print('  %-39s %12d' % (client, count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+'''
+Resolve X-Forwarded-For headers in bulk.
+
+resolve() applies a policy to a sequence of stored header values, for
+example in analytics jobs. With NumPy installed (pip install
+django-xff[numpy]) the work is done with vectorized string and array
+operations in chunks, overlong headers aside, otherwise with a loop over
+Policy.decide(). Either way it returns the same lists; resolve_numpy()
+returns the NumPy arrays.
+
+Client addresses are returned as integers of their IPv6 form, IPv4
+addresses mapped into ::ffff:0:0/96. 0 means no client address, either
+because the request is rejected or the entry is not an address.
+'''
+import ipaddress
+
+from .policy import (
+    ACCEPT, EXEMPT, LOOSE, NO_HEADER, NO_HEADER_REJECT, SPOOF, SPOOF_REJECT,
+    STEALTH, STRICT_REJECT, TOO_FEW, TOO_FEW_REJECT,
+)
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+MAPPED_IPV4 = 0xffff << 32
+LOW_BITS = (1 << 64) - 1
+
+# NumPy strings are fixed width, so headers are converted CHUNK at a time
+# and headers longer than MAX_WIDTH are left to Policy.decide(), which
+# keeps one forged chain from widening every row.
+CHUNK = 4096
+MAX_WIDTH = 256
+
+
+def address_to_int(address):
+    ''' Integer of the IPv6 form of address, 0 when it is invalid '''
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return 0
+    if ip.version == 4:
+        return MAPPED_IPV4 | int(ip)
+    return int(ip)
+
+
+def int_to_address(value):
+    ''' The address of an integer returned by resolve() '''
+    if not value:
+        return None
+    ip = ipaddress.IPv6Address(value)
+    return str(ip.ipv4_mapped or ip)
+
+
+def resolve_loop(headers, policy, exempt=None):
+    '''
+    Returns lists of verdicts, hop counts and client address integers.
+    '''
+    verdicts = []
+    hops = []
+    clients = []
+    depth = policy.depth
+    for index, header in enumerate(headers):
+        is_exempt = bool(exempt[index]) if exempt is not None else False
+        if header:
+            decision = policy.decide(header, depth, is_exempt)
+        else:
+            decision = policy.decide_missing(is_exempt)
+        verdicts.append(decision.verdict)
+        hops.append(decision.hops)
+        clients.append(address_to_int(decision.client)
+                       if decision.client else 0)
+    return verdicts, hops, clients
+
+
+def resolve_numpy(headers, policy, exempt=None):
+    '''
+    Returns arrays of verdicts (int8), hop counts (int64) and client
+    addresses as an (n, 2) uint64 array of the high and low 64 bits.
+    '''
+    np = numpy
+    headers = np.asarray(headers, dtype=object)
+    headers = np.where(np.equal(headers, None), '', headers)
+    count = len(headers)
+    if exempt is None:
+        exempt = np.zeros(count, dtype=bool)
+    else:
+        exempt = np.asarray(exempt, dtype=bool)
+
+    verdicts = np.zeros(count, dtype=np.int8)
+    hops = np.zeros(count, dtype=np.int64)
+    clients = np.zeros((count, 2), dtype=np.uint64)
+    lengths = np.frompyfunc(len, 1, 1)(headers).astype(np.int64)
+    short = np.flatnonzero(lengths <= MAX_WIDTH)
+    for start in range(0, len(short), CHUNK):
+        rows = short[start:start + CHUNK]
+        verdicts[rows], hops[rows], clients[rows] = resolve_chunk(
+            headers[rows].astype(str), policy, exempt[rows])
+    overlong = np.flatnonzero(lengths > MAX_WIDTH)
+    if len(overlong):
+        verdicts[overlong], hops[overlong], values = resolve_loop(
+            headers[overlong], policy, exempt[overlong])
+        clients[overlong, 0] = [value >> 64 for value in values]
+        clients[overlong, 1] = [value & LOW_BITS for value in values]
+    return verdicts, hops, clients
+
+
+def resolve_chunk(headers, policy, exempt):
+    '''
+    resolve_numpy() of a NumPy string array of headers.
+    '''
+    np = numpy
+    count = len(headers)
+    depth = policy.depth
+    present = np.char.str_len(headers) > 0
+    hops = np.where(present, np.char.count(headers, ',') + 1, 0)
+
+    # Assigned from the last branch of Policy.decide_levels to the first
+    # so that earlier branches win.
+    verdicts = np.full(count, ACCEPT, dtype=np.int8)
+    too_few = present & ((hops < depth) | (depth == 0))
+    spoof = present & ~too_few & (hops > depth)
+    verdicts[too_few] = TOO_FEW_REJECT if policy.always_proxy else TOO_FEW
+    verdicts[spoof] = SPOOF_REJECT if policy.no_spoofing else SPOOF
+    if policy.strict:
+        verdicts[present & (hops != depth)] = STRICT_REJECT
+    if policy.loose:
+        verdicts[present] = LOOSE
+    verdicts[present & exempt] = EXEMPT
+    if policy.stealth:
+        verdicts[present & exempt & (hops >= depth)] = STEALTH
+    if policy.header_required and not policy.loose:
+        verdicts[~present] = np.where(exempt[~present], NO_HEADER,
+                                      NO_HEADER_REJECT)
+    else:
+        verdicts[~present] = NO_HEADER
+
+    clients = np.zeros((count, 2), dtype=np.uint64)
+    if not policy.rewrite_remote:
+        return verdicts, hops, clients
+
+    first = np.isin(verdicts, (EXEMPT, LOOSE, TOO_FEW))
+    trusted = np.isin(verdicts, (ACCEPT, SPOOF))
+    entries = np.full(count, '', dtype=headers.dtype)
+    if first.any():
+        entries[first] = np.char.partition(headers[first], ',')[:, 0]
+    if depth and trusted.any():
+        rest = headers[trusted]
+        for _ in range(depth - 1):
+            rest = np.char.rpartition(rest, ',')[:, 0]
+        entries[trusted] = np.char.rpartition(rest, ',')[:, 2]
+    entries = np.char.strip(entries)
+
+    unique, inverse = np.unique(entries, return_inverse=True)
+    values = [address_to_int(entry) if entry else 0 for entry in unique]
+    high = np.array([value >> 64 for value in values], dtype=np.uint64)
+    low = np.array([value & LOW_BITS for value in values], dtype=np.uint64)
+    clients[:, 0] = high[inverse.ravel()]
+    clients[:, 1] = low[inverse.ravel()]
+    return verdicts, hops, clients
+
+
+def resolve(headers, policy, exempt=None):
+    '''
+    Resolve headers (None or '' for a missing header) with policy and an
+    optional sequence of exempt flags.
+
+    Returns lists of verdicts, hop counts and client address integers,
+    like resolve_loop(), computed with resolve_numpy() when NumPy is
+    installed.
+    '''
+    if numpy is None:
+        return resolve_loop(headers, policy, exempt)
+    verdicts, hops, clients = resolve_numpy(headers, policy, exempt)
+    high = clients[:, 0].astype(object)
+    low = clients[:, 1].astype(object)
+    return verdicts.tolist(), hops.tolist(), (high << 64 | low).tolist()
@@ -0,0 +1,233 @@
+''' Timing helpers for the XFF middleware '''
+import statistics
+import time
+import tracemalloc
+
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from .middleware import XForwardedForMiddleware
+from .policy import VERDICTS
+
+DEPTH = 3
+
+# Settings of each mode on top of XFF_TRUSTED_PROXY_DEPTH = DEPTH
+MODES = {
+    'default': {},
+    'strict': {'XFF_STRICT': True},
+    'no_spoofing': {'XFF_NO_SPOOFING': True},
+    'always_proxy': {'XFF_ALWAYS_PROXY': True},
+    'loose': {'XFF_LOOSE_UNSAFE': True},
+    'stealth': {'XFF_EXEMPT_STEALTH': True},
+}
+
+HOPS = (1, 3, 50, 5000)
+EXEMPT_SIZES = (0, 10, 100)
+
+OK = HttpResponse('OK')
+
+
+def stub_response(request):
+    return OK
+
+
+def make_header(hops, offset=0):
+    ''' An X-Forwarded-For header with hops distinct addresses '''
+    return ', '.join('10.%d.%d.%d' % ((offset + i) >> 16 & 255,
+                                      (offset + i) >> 8 & 255,
+                                      (offset + i) & 255)
+                     for i in range(hops))
+
+
+def make_exempt_urls(count, match=None):
+    ''' count exempt URL patterns, the last one matching match '''
+    urls = [r'^exempt-%d/' % i for i in range(count)]
+    if match is not None and urls:
+        urls[-1] = match
+    return urls
+
+
+def build(**xff_settings):
+    ''' A middleware with a stub response under the given settings '''
+    with override_settings(**xff_settings):
+        return XForwardedForMiddleware(stub_response)
+
+
+def time_calls(middleware, requests, repeat=5):
+    '''
+    Time middleware over the prepared requests repeat times.
+
+    A request is changed by the middleware, so every request is used
+    once per round and the rounds need their own lists.
+    '''
+    timings = []
+    for batch in requests[:repeat]:
+        start = time.perf_counter_ns()
+        for request in batch:
+            middleware(request)
+        timings.append((time.perf_counter_ns() - start) / len(batch))
+    return {
+        'best_ns': min(timings),
+        'median_ns': statistics.median(timings),
+    }
+
+
+def make_requests(header, path='/', number=1000, repeat=5, meta=None):
+    factory = RequestFactory()
+    extra = dict(meta or {})
+    if header is not None:
+        extra['HTTP_X_FORWARDED_FOR'] = header
+    return [[factory.get(path, **extra) for _ in range(number)]
+            for _ in range(repeat)]
+
+
+def status(middleware, header, path='/'):
+    ''' Status code of one request through middleware '''
+    request = make_requests(header, path, 1, 1)[0][0]
+    return middleware(request).status_code
+
+
+def run_case(name, xff_settings, header, path='/', number=1000, repeat=5):
+    middleware = build(**xff_settings)
+    result = {
+        'name': name,
+        'status': status(middleware, header, path),
+    }
+    result.update(time_calls(
+        middleware, make_requests(header, path, number, repeat), repeat))
+    return result
+
+
+def cases():
+    '''
+    The standard cases: every mode with every header length and without
+    the header, and the default mode with exempt lists of various sizes.
+    '''
+    for mode, overrides in MODES.items():
+        xff_settings = dict(overrides, XFF_TRUSTED_PROXY_DEPTH=DEPTH,
+                            XFF_EXEMPT_URLS=make_exempt_urls(1, r'^health/'))
+        for hops in HOPS + (None,):
+            yield {
+                'name': '%s/hops=%s' % (mode, hops or 0),
+                'mode': mode,
+                'hops': hops or 0,
+                'exempt_urls': 1,
+                'path': '/',
+                'settings': xff_settings,
+            }
+        yield {
+            'name': '%s/exempt' % mode,
+            'mode': mode,
+            'hops': DEPTH,
+            'exempt_urls': 1,
+            'path': '/health/',
+            'settings': xff_settings,
+        }
+
+    for size in EXEMPT_SIZES:
+        for exempt in (False, True):
+            yield {
+                'name': 'default/exempt_urls=%d%s' % (
+                    size, '/exempt' if exempt else ''),
+                'mode': 'default',
+                'hops': DEPTH,
+                'exempt_urls': size,
+                'path': '/health/' if exempt else '/',
+                'settings': {
+                    'XFF_TRUSTED_PROXY_DEPTH': DEPTH,
+                    'XFF_EXEMPT_URLS': make_exempt_urls(size, r'^health/'),
+                },
+            }
+
+
+def run(number=1000, repeat=5, select=None):
+    results = []
+    for case in cases():
+        if select and select not in case['name']:
+            continue
+        hops = case['hops']
+        header = make_header(hops) if hops else None
+        count = max(1, number // max(1, hops // 50))
+        result = run_case(case['name'], case['settings'], header,
+                          case['path'], count, repeat)
+        result.update(mode=case['mode'], hops=hops,
+                      exempt_urls=case['exempt_urls'])
+        results.append(result)
+    return results
+
+
+def compare(old, new):
+    '''
+    Pair up results by name: (name, old best, new best, ratio).
+    '''
+    previous = {result['name']: result for result in old}
+    for result in new:
+        if result['name'] in previous:
+            before = previous[result['name']]['best_ns']
+            yield (result['name'], before, result['best_ns'],
+                   result['best_ns'] / before)
+
+
+class VerdictRecorder:
+    '''
+    Stands in for the metrics of a middleware to find out which branch
+    the last request took.
+    '''
+    verdict = None
+
+    def observe(self, verdict, hops):
+        self.verdict = verdict
+
+
+def generate_corpus(depth):
+    '''
+    Headers from one hop to two hops over depth, and a missing header.
+    '''
+    return [make_header(hops, hops * 256) for hops in range(1, depth + 3)
+            ] + [None]
+
+
+def profile(middleware, headers, paths=('/',), number=100):
+    '''
+    Time every header on every path number times and group the timings
+    by the branch the middleware took.
+
+    Returns {verdict name: {'requests', 'mean_ns', 'p99_ns',
+    'peak_bytes'}} where peak_bytes is the mean of the peak allocated
+    during a request, measured in a separate pass.
+    '''
+    recorder = VerdictRecorder()
+    middleware.metrics = recorder
+    timings = {}
+    peaks = {}
+
+    for path in paths:
+        for header in headers:
+            for request in make_requests(header, path, number, 1)[0]:
+                start = time.perf_counter_ns()
+                middleware(request)
+                elapsed = time.perf_counter_ns() - start
+                timings.setdefault(recorder.verdict, []).append(elapsed)
+
+            tracemalloc.start()
+            try:
+                for request in make_requests(header, path, 10, 1)[0]:
+                    current = tracemalloc.get_traced_memory()[0]
+                    tracemalloc.reset_peak()
+                    middleware(request)
+                    peaks.setdefault(recorder.verdict, []).append(
+                        tracemalloc.get_traced_memory()[1] - current)
+            finally:
+                tracemalloc.stop()
+
+    results = {}
+    for verdict, values in sorted(timings.items()):
+        values.sort()
+        results[VERDICTS[verdict]] = {
+            'requests': len(values),
+            'mean_ns': statistics.mean(values),
+            'p99_ns': values[max(0, len(values) * 99 // 100 - 1)],
+            'peak_bytes': statistics.mean(peaks.get(verdict, [0])),
+        }
+    return results
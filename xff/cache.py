@@ -0,0 +1,71 @@
+''' Bounded cache for XFF decisions '''
+import threading
+from collections import OrderedDict
+
+
+class DecisionCache:
+    '''
+    Least recently used cache of decisions.
+
+    Keys are (header, exempt, depth, policy) tuples. The peer address
+    only changes a decision through the trusted depth, so it is not part
+    of the key. The cache must be cleared whenever the policy is rebuilt.
+    A lock keeps the entries consistent between threads, like Django's
+    local memory cache.
+    '''
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            try:
+                decision = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return decision
+
+    def put(self, key, decision):
+        with self.lock:
+            self.entries[key] = decision
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def keys(self):
+        ''' The keys, least recently used first '''
+        with self.lock:
+            return list(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+decision_cache = None
+
+
+def enable(maxsize):
+    ''' Cache decisions in a new module level cache '''
+    global decision_cache
+    decision_cache = DecisionCache(maxsize)
+    return decision_cache
@@ -0,0 +1,73 @@
+''' Trusted depth calibration from live traffic '''
+from .metrics import MAX_HOPS
+
+
+class DepthCalibrator:
+    '''
+    Histograms of the hop count of a sample of requests.
+
+    Every interval-th request with the header is counted, keyed by the
+    first of prefixes the path starts with and, with by_peer, by the
+    address of the direct peer. At most max_keys histograms are kept.
+    '''
+    def __init__(self, interval=100, prefixes=(), by_peer=False,
+                 max_keys=1000):
+        self.interval = interval
+        self.prefixes = tuple(prefixes)
+        self.by_peer = by_peer
+        self.max_keys = max_keys
+        self.countdown = interval
+        self.histograms = {}
+
+    def observe(self, request, path, hops):
+        # Threads racing past 0 must not stop the sampling for good
+        self.countdown -= 1
+        if self.countdown > 0:
+            return
+        self.countdown = self.interval
+
+        prefix = ''
+        for candidate in self.prefixes:
+            if path.startswith(candidate):
+                prefix = candidate
+                break
+        peer = request.META.get('REMOTE_ADDR', '') if self.by_peer else ''
+
+        histogram = self.histograms.get((prefix, peer))
+        if histogram is None:
+            if len(self.histograms) >= self.max_keys:
+                return
+            histogram = self.histograms[(prefix, peer)] = [0] * (MAX_HOPS + 1)
+        histogram[hops if hops < MAX_HOPS else MAX_HOPS] += 1
+
+    def recommend(self):
+        '''
+        The most common hop count for each key, with the share of the
+        samples that had it. Spoofed headers are longer and direct
+        requests shorter, so legitimate traffic should make up the mode.
+        '''
+        recommendations = []
+        for (prefix, peer), histogram in sorted(self.histograms.items()):
+            samples = sum(histogram)
+            depth = max(range(len(histogram)), key=histogram.__getitem__)
+            recommendations.append({
+                'prefix': prefix,
+                'peer': peer,
+                'depth': depth,
+                'share': histogram[depth] / samples,
+                'samples': samples,
+                'histogram': {hops: count
+                              for hops, count in enumerate(histogram)
+                              if count},
+            })
+        return recommendations
+
+
+calibrator = None
+
+
+def enable(interval=100, prefixes=(), by_peer=False):
+    ''' Start collecting into a new module level calibrator '''
+    global calibrator
+    calibrator = DepthCalibrator(interval, prefixes, by_peer)
+    return calibrator
@@ -0,0 +1,79 @@
+''' Exemption of URLs by name, namespace or view '''
+import functools
+import re
+
+from django.urls import URLResolver, get_resolver, get_urlconf
+from django.utils.module_loading import import_string
+
+
+class ViewExemptions:
+    '''
+    Exempt the routes of the URLconf selected by URL name, namespace or
+    view.
+
+    Each entry of specs is a view callable or a string: 'name' or
+    'namespace:name' for a URL name, 'namespace:' for every URL in a
+    namespace and a dotted path for a view. On the first request the
+    URLconf is walked and the full patterns of the selected routes are
+    compiled. Results are cached per path in an LRU cache of cache_size
+    entries. Both are rebuilt whenever the URL resolver changes.
+    '''
+    def __init__(self, specs, cache_size=4096):
+        self.names = set()
+        self.namespaces = set()
+        self.views = set()
+        for spec in specs:
+            if callable(spec):
+                self.views.add(spec)
+            elif spec.endswith(':'):
+                self.namespaces.add(spec[:-1])
+            elif '.' in spec:
+                self.views.add(import_string(spec))
+            else:
+                self.names.add(spec)
+        self.cache_size = cache_size
+        self.resolver = None
+
+    def selected(self, pattern, namespaces):
+        if pattern.name is not None and \
+                ':'.join(namespaces + [pattern.name]) in self.names:
+            return True
+        for depth in range(1, len(namespaces) + 1):
+            if ':'.join(namespaces[:depth]) in self.namespaces:
+                return True
+        callback = pattern.callback
+        return (callback in self.views or
+                getattr(callback, 'view_class', None) in self.views)
+
+    def compile(self, patterns, prefix='', namespaces=()):
+        '''
+        Yield the full regular expressions of the selected patterns.
+        '''
+        for pattern in patterns:
+            regex = prefix + pattern.pattern.regex.pattern.lstrip('^')
+            if isinstance(pattern, URLResolver):
+                inner = list(namespaces)
+                if pattern.namespace:
+                    inner.append(pattern.namespace)
+                yield from self.compile(pattern.url_patterns, regex, inner)
+            elif self.selected(pattern, list(namespaces)):
+                yield regex
+
+    def build(self, resolver):
+        regexes = [re.compile(regex)
+                   for regex in self.compile(resolver.url_patterns)]
+
+        @functools.lru_cache(self.cache_size)
+        def match(path):
+            return any(regex.match(path) for regex in regexes)
+
+        self.resolver = resolver
+        self.regexes = regexes
+        self.cached_match = match
+
+    def match(self, path):
+        ''' True when path, without the leading slash, is exempt '''
+        resolver = get_resolver(get_urlconf())
+        if resolver is not self.resolver:
+            self.build(resolver)
+        return self.cached_match(path)
@@ -0,0 +1,190 @@
+''' Logging helpers for the XFF middleware '''
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+
+class RateLimitFilter(logging.Filter):
+    '''
+    Let through at most burst records of each message per period.
+
+    Records are told apart by their unformatted message, so every log
+    call site is limited separately no matter what its arguments are.
+    The first record let through after a period with dropped records
+    reports how many were dropped. With a logger, a timer also sends
+    that report to its handlers when the period ends, so it is not lost
+    when the message is not logged again.
+    '''
+    def __init__(self, burst=10, period=60.0, clock=time.monotonic,
+                 logger=None):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        self.clock = clock
+        self.logger = logger
+        self.windows = {}
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        now = self.clock()
+        window = self.windows.get(record.msg)
+
+        if window is None or now - window[0] >= self.period:
+            self.windows[record.msg] = [now, 1, 0, None]
+            if window is not None and window[2]:
+                record.msg = '%s\n(%d similar messages suppressed)' % (
+                    record.getMessage(), window[2])
+                record.args = None
+            return True
+
+        if window[1] < self.burst:
+            window[1] += 1
+            return True
+
+        window[2] += 1
+        window[3] = record
+        if self.logger is not None and self.timer is None:
+            self.schedule(window[0] + self.period - now)
+        return False
+
+    def schedule(self, delay):
+        with self.lock:
+            if self.timer is None:
+                self.timer = threading.Timer(max(0, delay), self.report)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def cancel(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+    def report(self):
+        '''
+        Send the report of every period that has ended with dropped
+        records to the handlers of the logger.
+        '''
+        with self.lock:
+            self.timer = None
+        now = self.clock()
+        pending = None
+        for msg, window in list(self.windows.items()):
+            if not window[2]:
+                continue
+            end = window[0] + self.period
+            if now < end:
+                pending = end - now if pending is None else \
+                    min(pending, end - now)
+                continue
+            self.windows.pop(msg, None)
+            record = window[3]
+            self.logger.callHandlers(logging.makeLogRecord(dict(
+                record.__dict__, args=None,
+                msg='%s\n(%d similar messages suppressed)' % (
+                    record.getMessage(), window[2]))))
+        if pending is not None:
+            self.schedule(pending)
+
+
+def rate_limit(logger, limit):
+    '''
+    Replace the rate limit of logger with (burst, period) or remove it.
+    '''
+    for log_filter in logger.filters[:]:
+        if isinstance(log_filter, RateLimitFilter):
+            log_filter.cancel()
+            logger.removeFilter(log_filter)
+    if limit:
+        logger.addFilter(RateLimitFilter(*limit, logger=logger))
+
+
+class DropOldestQueueHandler(logging.handlers.QueueHandler):
+    '''
+    Queue handler that never blocks on a full queue.
+
+    The oldest queued record is dropped to make room and counted in
+    dropped.
+    '''
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+
+class QueueLogging:
+    '''
+    Move the handlers of a logger to a background thread.
+
+    Records are put on a bounded queue by the request thread and handed
+    by a QueueListener to the handlers of the logger and to those of the
+    ancestors it propagates to, as found when it is created. The logger
+    stops propagating while they are moved, so no handler is called from
+    the request thread.
+    '''
+    def __init__(self, logger, maxsize=10000):
+        self.logger = logger
+        self.handlers = logger.handlers[:]
+        self.propagate = logger.propagate
+        inherited = []
+        ancestor = logger
+        while ancestor.propagate and ancestor.parent is not None:
+            ancestor = ancestor.parent
+            inherited.extend(ancestor.handlers)
+        self.handler = DropOldestQueueHandler(queue.Queue(maxsize))
+        self.listener = logging.handlers.QueueListener(
+            self.handler.queue, *self.handlers, *inherited,
+            respect_handler_level=True)
+
+    @property
+    def dropped(self):
+        return self.handler.dropped
+
+    def start(self):
+        for handler in self.handlers:
+            self.logger.removeHandler(handler)
+        self.logger.addHandler(self.handler)
+        self.logger.propagate = False
+        self.listener.start()
+
+    def stop(self):
+        '''
+        Flush the queue and give the handlers back to the logger.
+        '''
+        self.listener.stop()
+        self.logger.removeHandler(self.handler)
+        self.logger.propagate = self.propagate
+        for handler in self.handlers:
+            self.logger.addHandler(handler)
+
+
+# The QueueLogging started by queue_logging(), if any
+shipper = None
+
+
+def queue_logging(maxsize=10000, name='xff.middleware'):
+    '''
+    Start shipping the records of the named logger from a background
+    thread. Only the first call has an effect. Returns the QueueLogging.
+    '''
+    global shipper
+    if shipper is None:
+        shipper = QueueLogging(logging.getLogger(name), maxsize)
+        shipper.start()
+        atexit.register(shipper.stop)
+    return shipper
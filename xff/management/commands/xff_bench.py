@@ -0,0 +1,72 @@
+import logging
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from xff import bench
+from xff.middleware import XForwardedForMiddleware
+
+# Settings that write files, which must not be touched by a benchmark run
+# on a production host
+SIDE_EFFECTS = {
+    'XFF_RECORD_SIZE': 0,
+    'XFF_SNAPSHOT_PATH': None,
+    'XFF_METRICS': False,
+    'XFF_METRICS_DIR': None,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the XFF middleware under the project's settings, per branch "
+        "of the decision."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--corpus',
+            help='file with one X-Forwarded-For value per line, an empty '
+                 'line is a request without the header. By default headers '
+                 'around XFF_TRUSTED_PROXY_DEPTH are generated.')
+        parser.add_argument(
+            '--path', action='append', dest='paths',
+            help='request path, may be repeated (default: /)')
+        parser.add_argument(
+            '--number', type=int, default=100,
+            help='requests per header and path (default: 100)')
+
+    def handle(self, *args, **options):
+        overrides = dict(SIDE_EFFECTS)
+        throttle = getattr(settings, 'XFF_THROTTLE', None)
+        if throttle and throttle.get('path'):
+            overrides['XFF_THROTTLE'] = dict(throttle, path=None)
+        try:
+            with override_settings(**overrides):
+                middleware = XForwardedForMiddleware(bench.stub_response)
+        except MiddlewareNotUsed as e:
+            raise CommandError(str(e))
+
+        if options['corpus']:
+            with open(options['corpus']) as corpus:
+                headers = [line.rstrip('\n') or None for line in corpus]
+        else:
+            headers = bench.generate_corpus(
+                getattr(settings, 'XFF_TRUSTED_PROXY_DEPTH', 0))
+
+        logger = logging.getLogger('xff.middleware')
+        disabled, logger.disabled = logger.disabled, True
+        try:
+            results = bench.profile(middleware, headers,
+                                    options['paths'] or ['/'],
+                                    options['number'])
+        finally:
+            logger.disabled = disabled
+
+        self.stdout.write('%-18s %9s %10s %10s %11s' % (
+            'branch', 'requests', 'mean us', 'p99 us', 'peak bytes'))
+        for name, result in results.items():
+            self.stdout.write('%-18s %9d %10.2f %10.2f %11.0f' % (
+                name, result['requests'], result['mean_ns'] / 1000,
+                result['p99_ns'] / 1000, result['peak_bytes']))
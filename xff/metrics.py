@@ -0,0 +1,173 @@
+''' In-process counters for the XFF middleware '''
+import glob
+import mmap
+import os
+from array import array
+
+from .policy import VERDICTS
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Hop counts above MAX_HOPS share the last histogram bucket
+MAX_HOPS = 16
+
+# Slot layout of Metrics.counts
+HOPS_OFFSET = len(VERDICTS)
+HOPS_SUM = HOPS_OFFSET + MAX_HOPS + 1
+SHADOW_OFFSET = HOPS_SUM + 1
+SLOTS = SHADOW_OFFSET + len(VERDICTS) * len(VERDICTS)
+
+
+class Metrics:
+    '''
+    Verdict counters and a histogram of the hop count in X-Forwarded-For.
+
+    All values live in one flat list of integers, counts, so recording
+    a request is a couple of integer increments.
+    '''
+    def __init__(self):
+        self.counts = [0] * SLOTS
+
+    def observe(self, verdict, hops):
+        counts = self.counts
+        counts[verdict] += 1
+        if hops:
+            counts[HOPS_OFFSET + (hops if hops < MAX_HOPS else MAX_HOPS)] += 1
+            counts[HOPS_SUM] += hops
+
+    def observe_shadow(self, verdict, shadow):
+        self.counts[SHADOW_OFFSET + verdict * len(VERDICTS) + shadow] += 1
+
+    def reset(self):
+        self.counts[:] = [0] * SLOTS
+
+    def render(self):
+        return render(self.counts)
+
+
+def render(counts):
+    '''
+    Render a counts list in the Prometheus text exposition format.
+    '''
+    lines = [
+        '# HELP xff_requests_total Requests by X-Forwarded-For verdict.',
+        '# TYPE xff_requests_total counter',
+    ]
+    for index, name in enumerate(VERDICTS):
+        lines.append('xff_requests_total{verdict="%s"} %d' % (
+            name, counts[index]))
+
+    lines += [
+        '# HELP xff_hops Addresses in the X-Forwarded-For header.',
+        '# TYPE xff_hops histogram',
+    ]
+    total = 0
+    for hops in range(1, MAX_HOPS + 1):
+        total += counts[HOPS_OFFSET + hops]
+        if hops < MAX_HOPS:
+            lines.append('xff_hops_bucket{le="%d"} %d' % (hops, total))
+    lines += [
+        'xff_hops_bucket{le="+Inf"} %d' % total,
+        'xff_hops_sum %d' % counts[HOPS_SUM],
+        'xff_hops_count %d' % total,
+        '# HELP xff_shadow_disagreements_total Requests where the shadow '
+        'policy disagrees.',
+        '# TYPE xff_shadow_disagreements_total counter',
+    ]
+    for index, name in enumerate(VERDICTS):
+        for shadow_index, shadow in enumerate(VERDICTS):
+            count = counts[SHADOW_OFFSET + index * len(VERDICTS) +
+                           shadow_index]
+            if count:
+                lines.append(
+                    'xff_shadow_disagreements_total'
+                    '{verdict="%s",shadow="%s"} %d' % (name, shadow, count))
+    return '\n'.join(lines) + '\n'
+
+
+def render_counters(counters):
+    '''
+    Render (name, help, value) counters in the Prometheus text exposition
+    format.
+    '''
+    lines = []
+    for name, text, value in counters:
+        lines += [
+            '# HELP %s %s' % (name, text),
+            '# TYPE %s counter' % name,
+            '%s %d' % (name, value),
+        ]
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+class MmapMetrics(Metrics):
+    '''
+    Metrics kept in a memory-mapped file per process.
+
+    Every worker process writes to its own xff-<pid>.db file in directory,
+    so increments need neither a lock nor a system call. The files of
+    recycled workers are kept and rendering sums all files, so the
+    counters survive worker restarts.
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        self.open()
+
+    def open(self):
+        path = os.path.join(self.directory, 'xff-%d.db' % os.getpid())
+        with open(path, 'a+b') as db:
+            db.truncate(SLOTS * 8)
+            self.mmap = mmap.mmap(db.fileno(), SLOTS * 8)
+        self.counts = memoryview(self.mmap).cast('Q')
+
+    def reset(self):
+        for path in self.paths():
+            os.remove(path)
+        self.open()
+
+    def paths(self):
+        return glob.glob(os.path.join(self.directory, 'xff-*.db'))
+
+    def collect(self):
+        '''
+        Sum the counts of all worker files.
+        '''
+        total = [0] * SLOTS
+        for path in self.paths():
+            counts = array('Q')
+            with open(path, 'rb') as db:
+                counts.frombytes(db.read())
+            if len(counts) != SLOTS:
+                continue
+            for index, value in enumerate(counts):
+                total[index] += value
+        return total
+
+    def render(self):
+        return render(self.collect())
+
+
+registry = Metrics()
+
+
+def enable(directory=None):
+    '''
+    Make registry an in-process or, with a directory, a memory-mapped
+    Metrics and return it.
+    '''
+    global registry
+    if directory is None:
+        if type(registry) is not Metrics:
+            registry = Metrics()
+    elif getattr(registry, 'directory', None) != directory:
+        registry = MmapMetrics(directory)
+    return registry
+
+
+def _after_fork():
+    if isinstance(registry, MmapMetrics):
+        registry.open()
+
+
+if hasattr(os, 'register_at_fork'):  # not on Windows
+    os.register_at_fork(after_in_child=_after_fork)
@@ -1,12 +1,49 @@
 ''' XFF Middleware '''
+import asyncio
+import atexit
 import logging
+import os
 import re
+import struct
+import threading
 
+from asgiref.sync import (
+    iscoroutinefunction, markcoroutinefunction, sync_to_async,
+)
 from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
 from django.http import HttpResponseBadRequest, HttpResponseNotFound
+from django.http.request import split_domain_port
+
+from . import cache
+from . import calibrate
+from . import metrics
+from . import snapshot
+from .exempt import ViewExemptions
+from .log import queue_logging, rate_limit
+from .peers import PeerDepths
+from .policy import (
+    ACCEPT, NO_HEADER_REJECT, SHED, SPOOF, SPOOF_REJECT, STEALTH,
+    STRICT_REJECT, THROTTLED, TOO_FEW, TOO_FEW_REJECT, VIOLATIONS, Policy,
+    split,
+)
+from .recorder import HeaderRecorder
+from .router import PrefixRouter
+from .shed import LoadShedder
+from .throttle import SharedTokenBuckets, TokenBuckets
 
 logger = logging.getLogger(__name__)
 
+# Returned by check() for throttled requests
+THROTTLE = object()
+
+# X-Forwarded-* headers and the META keys they rewrite
+FORWARDED_HEADERS = {
+    'proto': ('HTTP_X_FORWARDED_PROTO', 'wsgi.url_scheme'),
+    'host': ('HTTP_X_FORWARDED_HOST', 'HTTP_HOST'),
+    'port': ('HTTP_X_FORWARDED_PORT', 'SERVER_PORT'),
+}
+
 
 class XForwardedForMiddleware:
     '''
@@ -35,91 +72,585 @@ class XForwardedForMiddleware:
     XFF_EXEMPT_URLS can be an iterable (eg. list) that defines URLs as
     regexps that will not be checked. XFF_EXEMPT_STEALTH = True will
     return a 404 when all proxies are present. This is nice for a
-    healthcheck URL that is not for the public eye.
+    healthcheck URL that is not for the public eye. XFF_EXEMPT_VIEWS can
+    list URL names ('name', 'namespace:name'), namespaces ('namespace:')
+    and views (callables or dotted paths) to exempt in the same way.
 
     XFF_HEADER_REQUIRED = True will return a bad request when the header
     is not set. By default it takes the same value as XFF_ALWAYS_PROXY.
+
+    XFF_FORWARDED_HEADERS can list 'proto', 'host' and 'port' to also
+    apply X-Forwarded-Proto, X-Forwarded-Host and X-Forwarded-Port from
+    the trusted depth to the scheme, HTTP_HOST and SERVER_PORT when the
+    X-Forwarded-For header is accepted or a spoof attempt, that is when
+    it has at least the trusted depth of entries. Otherwise they are left
+    alone, as they may come from the client. They are cleaned the same
+    way.
+
+    XFF_THROTTLE can be a dict with rate, burst, size and key ('client' or
+    'peer'). Headers of the wrong length then take a token from a bucket
+    per key and are answered with a bad request when it is empty. With a
+    path, the buckets are kept in a file shared by all processes.
+
+    XFF_SHED can be a dict with threshold, resume and window. When the
+    share of headers of the wrong length in the last window requests
+    reaches threshold, the middleware only counts the entries of a
+    header and answers a bad request without logging when it is not the
+    trusted depth, until the share falls below resume. Requests without
+    the header, exempt URLs and loose policies are not shed.
+
+    XFF_DECISION_CACHE_SIZE = N keeps the decisions for the N most
+    recently seen headers, so repeated chains are not parsed again.
+
+    XFF_LOG_RATE_LIMIT = (count, seconds) lets through at most count
+    records of each message per period and reports how many were dropped.
+    XFF_LOG_QUEUE_SIZE = N writes the log records from a background thread
+    through a queue of N records that drops the oldest when full.
+
+    XFF_METRICS = True counts the verdicts and hop counts of all requests
+    for the xff.views.metrics view. With XFF_METRICS_DIR they are kept in
+    a memory-mapped file per process and summed when rendered.
+
+    XFF_RECORD_SIZE = N keeps a random sample of N headers and writes it
+    to XFF_RECORD_PATH every XFF_RECORD_INTERVAL seconds and at exit.
+    XFF_RECORD_ANONYMIZE = True replaces the addresses with pseudonyms.
+
+    XFF_PATH_POLICIES can be a list of (prefix, settings) pairs where
+    settings is a dict of XFF settings used instead of the global ones for
+    paths that start with prefix. The longest matching prefix wins.
+    XFF_HOST_POLICIES can be a dict of Host header values to settings in
+    the same way. Path policies take precedence over host policies.
+
+    XFF_PEER_DEPTHS can be a dict of networks to trusted depths. The
+    depth of the most specific network of REMOTE_ADDR is used instead of
+    the depth of the policy. Lookups are cached for XFF_PEER_CACHE_SIZE
+    peers.
+
+    XFF_SHADOW_POLICY can be a dict of XFF settings to evaluate as a
+    second policy next to the active one, on top of the settings of the
+    path or host policy in use. Requests where its verdict differs are
+    only counted in the metrics.
+
+    XFF_CALIBRATE_INTERVAL = N counts the hop count of every Nth request
+    for the xff.views.calibration view, optionally per path prefix in
+    XFF_CALIBRATE_PREFIXES and per peer with XFF_CALIBRATE_BY_PEER.
+
+    XFF_SNAPSHOT_PATH names a file that the throttle buckets, the
+    calibration histograms and the headers in the decision cache are
+    written to by a background thread every XFF_SNAPSHOT_INTERVAL seconds
+    and at exit, and read back from at startup, so a new worker does not
+    start cold.
+
+    Under ASGI, XFF_TARPIT_DELAY = N holds throttled requests for N
+    seconds before answering them, at most XFF_TARPIT_MAX (100) at a
+    time, so that repeat offenders are slowed down without tying up a
+    thread. The checks run on the event loop, except with a shared
+    throttle table, whose locks are then waited for in a thread, or a
+    custom get_trusted_depth(), which may be sync-only code such as the
+    ORM. Set XFF_LOG_QUEUE_SIZE as well so that log handlers do not block
+    the event loop.
+
+    When the configuration cannot change, reject, count, record or sample
+    any request, the middleware raises MiddlewareNotUsed at startup and
+    Django drops it from the chain.
     '''
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response=None):
         self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        self.custom_depth = (
+            type(self).get_trusted_depth is not
+            XForwardedForMiddleware.get_trusted_depth)
+
+        cache_size = getattr(settings, 'XFF_DECISION_CACHE_SIZE', 0)
+        self.cache = cache.enable(cache_size) if cache_size else None
+        throttle = getattr(settings, 'XFF_THROTTLE', None)
+        self.throttle = None
+        if throttle:
+            if throttle.get('path'):
+                self.throttle = SharedTokenBuckets(
+                    throttle['path'], throttle.get('rate', 1.0),
+                    throttle.get('burst', 10), throttle.get('size', 10000))
+            else:
+                self.throttle = TokenBuckets(
+                    throttle.get('rate', 1.0), throttle.get('burst', 10),
+                    throttle.get('size', 10000))
+            self.throttle_peer = throttle.get('key', 'client') == 'peer'
+        # Under ASGI, check() runs in a thread when it may block the event
+        # loop on the lock of the shared table, or when a custom
+        # get_trusted_depth() may use the ORM, like Django runs sync-only
+        # middleware.
+        self.check_in_thread = self.custom_depth or \
+            isinstance(self.throttle, SharedTokenBuckets)
+        shed = getattr(settings, 'XFF_SHED', None)
+        self.shedder = LoadShedder(
+            shed.get('threshold', 0.5), shed.get('resume'),
+            shed.get('window', 1000)) if shed else None
+        self.tarpit_delay = getattr(settings, 'XFF_TARPIT_DELAY', 0)
+        self.tarpit_max = getattr(settings, 'XFF_TARPIT_MAX', 100)
+        self.tarpitted = 0
+        self.forwarded = tuple(
+            FORWARDED_HEADERS[name]
+            for name in getattr(settings, 'XFF_FORWARDED_HEADERS', ()))
+        peer_depths = getattr(settings, 'XFF_PEER_DEPTHS', None)
+        self.peers = PeerDepths(
+            peer_depths, getattr(settings, 'XFF_PEER_CACHE_SIZE', 1024),
+        ) if peer_depths else None
+        self.rebuild()
+        if self.is_noop():
+            reason = ('XFF middleware disabled: XFF_TRUSTED_PROXY_DEPTH is 0 '
+                      'and no setting can change or reject a request.')
+            logger.info(reason)
+            raise MiddlewareNotUsed(reason)
 
-        self.stealth = getattr(settings, 'XFF_EXEMPT_STEALTH', False)
-        self.loose = getattr(settings, 'XFF_LOOSE_UNSAFE', False)
-        self.strict = getattr(settings, 'XFF_STRICT', False)
-        self.always_proxy = getattr(settings, 'XFF_ALWAYS_PROXY', False)
-        self.no_spoofing = getattr(settings, 'XFF_NO_SPOOFING', False)
-        self.header_required = getattr(settings, 'XFF_HEADER_REQUIRED',
-                                       (self.always_proxy or self.strict))
-        self.clean = getattr(settings, 'XFF_CLEAN', True)
-        self.rewrite_remote = getattr(settings, 'XFF_REWRITE_REMOTE_ADDR',
-                                      True)
+        self.metrics = None
+        if getattr(settings, 'XFF_METRICS', False):
+            self.metrics = metrics.enable(
+                getattr(settings, 'XFF_METRICS_DIR', None))
+        record_size = getattr(settings, 'XFF_RECORD_SIZE', 0)
+        self.recorder = HeaderRecorder(
+            record_size,
+            getattr(settings, 'XFF_RECORD_PATH', None),
+            getattr(settings, 'XFF_RECORD_INTERVAL', None),
+            getattr(settings, 'XFF_RECORD_ANONYMIZE', False),
+        ).install() if record_size else None
+        interval = getattr(settings, 'XFF_CALIBRATE_INTERVAL', 0)
+        self.calibrator = calibrate.enable(
+            interval,
+            getattr(settings, 'XFF_CALIBRATE_PREFIXES', ()),
+            getattr(settings, 'XFF_CALIBRATE_BY_PEER', False),
+        ) if interval else None
+        rate_limit(logging.getLogger(__name__),
+                   getattr(settings, 'XFF_LOG_RATE_LIMIT', None))
+        queue_size = getattr(settings, 'XFF_LOG_QUEUE_SIZE', 0)
+        if queue_size:
+            queue_logging(queue_size, __name__)
 
+        # Set by the first request, so processes that serve none leave
+        # the snapshot alone
+        self.served = False
+        self.snapshot_path = getattr(settings, 'XFF_SNAPSHOT_PATH', None)
+        if self.snapshot_path is not None:
+            self.snapshot_interval = getattr(
+                settings, 'XFF_SNAPSHOT_INTERVAL', 60)
+            self.restore_snapshot()
+            self.start_snapshots()
+            if hasattr(os, 'register_at_fork'):
+                os.register_at_fork(after_in_child=self.snapshot_after_fork)
+            atexit.register(self.stop_snapshots)
+
+    def rebuild(self):
+        '''
+        Compile the policy from settings and expire cached decisions.
+        '''
+        shadow = getattr(settings, 'XFF_SHADOW_POLICY', None)
+        # The shadow of each policy, built from its overrides and the
+        # shadow overrides on top
+        self.shadows = {}
+
+        def build(overrides=None):
+            policy = Policy.from_settings(overrides)
+            if shadow:
+                self.shadows[policy] = Policy.from_settings(
+                    dict(overrides or {}, **shadow))
+            return policy
+
+        self.policy = build()
+        path_policies = getattr(settings, 'XFF_PATH_POLICIES', None)
+        self.router = PrefixRouter(
+            [(prefix, build(overrides))
+             for prefix, overrides in path_policies]
+        ) if path_policies else None
+        host_policies = getattr(settings, 'XFF_HOST_POLICIES', None)
+        self.hosts = {
+            split_domain_port(host)[0]: build(overrides)
+            for host, overrides in host_policies.items()
+        } if host_policies else None
+        self.shadow = self.shadows.get(self.policy)
+        self.shadow_depth = bool(shadow) and \
+            'XFF_TRUSTED_PROXY_DEPTH' in shadow
+        self.shadow_metrics = metrics.enable(
+            getattr(settings, 'XFF_METRICS_DIR', None)) if shadow else None
         self.exempt_urls = [
             re.compile(expr)
             for expr in getattr(settings, 'XFF_EXEMPT_URLS', [])
         ]
+        exempt_views = getattr(settings, 'XFF_EXEMPT_VIEWS', None)
+        self.exempt_views = (ViewExemptions(exempt_views)
+                             if exempt_views else None)
+        if self.cache is not None:
+            self.cache.clear()
+
+    def is_noop(self):
+        '''
+        True when no request can be rejected or rewritten and nothing
+        is observed.
+
+        A custom get_trusted_depth() may return anything per request, so
+        it is never considered a no-op. Metrics, recording and calibration
+        are how a depth is found in the first place, so they keep the
+        middleware as well.
+        '''
+        if self.custom_depth or self.peers is not None or \
+                self.shadow is not None or self.forwarded or \
+                self.throttle is not None:
+            return False
+        if getattr(settings, 'XFF_METRICS', False) or \
+                getattr(settings, 'XFF_RECORD_SIZE', 0) or \
+                getattr(settings, 'XFF_CALIBRATE_INTERVAL', 0):
+            return False
+        if self.router is not None and not all(
+                policy.is_noop() for policy in self.router.values()):
+            return False
+        if self.hosts is not None and not all(
+                policy.is_noop() for policy in self.hosts.values()):
+            return False
+        return self.policy.is_noop() and not (
+            self.policy.stealth and (self.exempt_urls or self.exempt_views))
+
+    def select_policy(self, path, meta):
+        '''
+        The policy of the longest matching path prefix, else the policy
+        of the host, else the global policy.
+        '''
+        if self.router is not None:
+            policy = self.router.lookup(path)
+            if policy is not None:
+                return policy
+        if self.hosts is not None:
+            host = meta.get('HTTP_HOST', '')
+            policy = self.hosts.get(host)
+            if policy is None:
+                policy = self.hosts.get(split_domain_port(host)[0],
+                                        self.policy)
+            return policy
+        return self.policy
+
+    def policies(self):
+        ''' Every policy in a stable order, the global one first '''
+        policies = [self.policy]
+        if self.router is not None:
+            policies.extend(self.router.values())
+        if self.hosts is not None:
+            policies.extend(self.hosts.values())
+        return policies
+
+    def start_snapshots(self):
+        '''
+        Save a snapshot every XFF_SNAPSHOT_INTERVAL seconds from a daemon
+        thread, so requests never wait for one.
+        '''
+        self.snapshots_stopped = threading.Event()
+        threading.Thread(target=self.snapshot_loop, name='xff-snapshot',
+                         args=(self.snapshots_stopped,), daemon=True).start()
+
+    def snapshot_after_fork(self):
+        '''
+        In a forked child, such as a worker of a server that loads the
+        application before forking, warm up again from the snapshot the
+        other workers have written since the parent read it, and start
+        the snapshot thread, which does not survive the fork.
+        '''
+        if not self.served:
+            if isinstance(self.throttle, TokenBuckets):
+                self.throttle.clear()
+            if self.calibrator is not None:
+                self.calibrator.histograms.clear()
+            if self.cache is not None:
+                self.cache.clear()
+            self.restore_snapshot()
+        self.start_snapshots()
+
+    def snapshot_loop(self, stopped):
+        while not stopped.wait(self.snapshot_interval):
+            self.save_snapshot()
+
+    def stop_snapshots(self):
+        ''' Stop the snapshot thread and save a last snapshot '''
+        self.snapshots_stopped.set()
+        self.save_snapshot()
+
+    def save_snapshot(self):
+        '''
+        Write the runtime state to XFF_SNAPSHOT_PATH. Errors are logged,
+        not raised. A process that has served no request, such as the
+        parent of preforked workers, would only replace what the workers
+        wrote and writes nothing.
+        '''
+        if not self.served:
+            return
+        state = {}
+        if isinstance(self.throttle, TokenBuckets):
+            state['buckets'] = self.throttle.dump()
+        if self.calibrator is not None:
+            state['histograms'] = dict(self.calibrator.histograms)
+        if self.cache is not None:
+            indexes = {policy: i for i, policy in enumerate(self.policies())}
+            state['hot'] = [
+                (indexes[policy], exempt, depth, header)
+                for header, exempt, depth, policy in self.cache.keys()
+                if policy in indexes
+            ]
+        try:
+            snapshot.write(self.snapshot_path, state)
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning('Could not write XFF snapshot %s: %s',
+                           self.snapshot_path, e)
+
+    def restore_snapshot(self):
+        '''
+        Warm up from the state in XFF_SNAPSHOT_PATH, if there is one.
+        Cached decisions are made again with the current policies.
+        '''
+        try:
+            state = snapshot.read(self.snapshot_path)
+        except FileNotFoundError:
+            return
+        except (OSError, snapshot.SnapshotError) as e:
+            logger.warning('Ignoring XFF snapshot %s: %s',
+                           self.snapshot_path, e)
+            return
+
+        if isinstance(self.throttle, TokenBuckets):
+            self.throttle.load(state.get('buckets', []), state['age'])
+        if self.calibrator is not None:
+            histograms = self.calibrator.histograms
+            for key, histogram in state.get('histograms', {}).items():
+                if len(histogram) != metrics.MAX_HOPS + 1:
+                    break
+                if key in histograms:
+                    histograms[key] = [
+                        a + b for a, b in zip(histograms[key], histogram)]
+                elif len(histograms) < self.calibrator.max_keys:
+                    histograms[key] = histogram
+        if self.cache is not None:
+            policies = self.policies()
+            for index, exempt, depth, header in state.get('hot', []):
+                if index < len(policies):
+                    policy = policies[index]
+                    self.cache.put((header, exempt, depth, policy),
+                                   self.decide(policy, header, depth, exempt))
+
+    def get_policy(self, request):
+        ''' The policy for request '''
+        return self.select_policy(request.path_info.lstrip('/'),
+                                  request.META)
 
     def get_trusted_depth(self, request):
-        return getattr(settings, 'XFF_TRUSTED_PROXY_DEPTH', 0)
+        policy = self.get_policy(request)
+        if self.peers is not None:
+            depth = self.peers.lookup(request.META.get('REMOTE_ADDR', ''))
+            if depth is not None:
+                return depth
+        return policy.depth
+
+    def decide(self, policy, header, depth, exempt):
+        '''
+        Decide a header with policy and the shadow policy, if any,
+        splitting it only once.
+        '''
+        if self.shadow is None:
+            return policy.decide(header, depth, exempt)
+        levels = split(header)
+        shadow = self.shadows[policy]
+        shadow = shadow.decide_levels(
+            levels, shadow.depth if self.shadow_depth else depth, exempt)
+        return policy.decide_levels(levels, depth, exempt)._replace(
+            shadow=shadow.verdict)
+
+    @staticmethod
+    def trusted_entry(header, depth):
+        '''
+        The entry of header at depth, or the first entry when it is
+        shorter. This is the client address of a rejected header, as it
+        would have been resolved without the rejection.
+        '''
+        levels = split(header)
+        return levels[-depth] if 0 < depth <= len(levels) else levels[0]
 
     def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        response = self.check(request)
+        if response is None:
+            return self.get_response(request)
+        if response is THROTTLE:
+            return HttpResponseBadRequest()
+        return response
+
+    async def __acall__(self, request):
+        if self.check_in_thread:
+            response = await sync_to_async(
+                self.check, thread_sensitive=self.custom_depth)(request)
+        else:
+            response = self.check(request)
+        if response is None:
+            return await self.get_response(request)
+        if response is THROTTLE:
+            if self.tarpit_delay and self.tarpitted < self.tarpit_max:
+                self.tarpitted += 1
+                try:
+                    await asyncio.sleep(self.tarpit_delay)
+                finally:
+                    self.tarpitted -= 1
+            return HttpResponseBadRequest()
+        return response
+
+    def check(self, request):
         '''
-        The beef.
+        The beef. Fixes up request and returns None to pass it on, or
+        returns the response to answer with, THROTTLE for a throttled
+        request.
         '''
+        self.served = True
         path = request.path_info.lstrip('/')
-        depth = self.get_trusted_depth(request)
-        exempt = any(m.match(path) for m in self.exempt_urls)
-
-        if header := request.headers.get("X-Forwarded-For"):
-            levels = [x.strip() for x in header.split(',')]
-
-            if len(levels) >= depth and exempt and self.stealth:
-                return HttpResponseNotFound()
-
-            if self.loose or exempt:
-                if self.rewrite_remote:
-                    request.META['REMOTE_ADDR'] = levels[0]
-                return self.get_response(request)
-
-            if len(levels) != depth and self.strict:
-                logger.warning((
-                    "Incorrect proxy depth in incoming request.\n" +
-                    'Expected {} and got {} remote addresses in ' +
-                    'X-Forwarded-For header.')
-                    .format(
-                        depth, len(levels)))
-                return HttpResponseBadRequest()
+        meta = request.META
+        if self.router is None and self.hosts is None:
+            policy = self.policy
+        else:
+            policy = self.select_policy(path, meta)
+        if self.custom_depth:
+            depth = self.get_trusted_depth(request)
+        elif self.peers is None:
+            depth = policy.depth
+        else:
+            depth = self.peers.lookup(meta.get('REMOTE_ADDR', ''))
+            if depth is None:
+                depth = policy.depth
+        exempt = any(m.match(path) for m in self.exempt_urls) or (
+            self.exempt_views is not None and self.exempt_views.match(path))
 
-            if len(levels) < depth or depth == 0:
-                logger.warning(
-                    'Not running behind as many reverse proxies as expected.' +
-                    "\nThe right value for XFF_TRUSTED_PROXY_DEPTH for this " +
-                    'request is {} and {} is configured.'.format(
-                        len(levels), depth)
-                )
-                if self.always_proxy:
+        # A header of the wrong length is exactly what the policy counts
+        # as a violation, so the shedder sees the same share either way.
+        # Requests without the header are left to the policy.
+        if self.shedder is not None and self.shedder.shedding and \
+                depth and not exempt and not policy.loose:
+            header = meta.get('HTTP_X_FORWARDED_FOR')
+            if header:
+                hops = header.count(',') + 1
+                if hops != depth:
+                    self.shedder.observe(True)
+                    if self.metrics is not None:
+                        self.metrics.observe(SHED, hops)
                     return HttpResponseBadRequest()
 
-                depth = len(levels)
-            elif len(levels) > depth:
-                logger.info(
-                    ('X-Forwarded-For spoof attempt with {} addresses when ' +
-                     '{} expected. Full header: {}').format(
-                         len(levels), depth, header))
-                if self.no_spoofing:
-                    return HttpResponseBadRequest()
+        if self.throttle is not None and self.throttle_peer and \
+                not exempt and self.throttle.blocked(meta.get('REMOTE_ADDR')):
+            if self.metrics is not None:
+                self.metrics.observe(THROTTLED, 0)
+            return THROTTLE
+
+        if header := meta.get('HTTP_X_FORWARDED_FOR'):
+            if self.recorder is not None:
+                self.recorder.record(header)
+            if self.cache is None:
+                decision = self.decide(policy, header, depth, exempt)
+            else:
+                key = (header, exempt, depth, policy)
+                decision = self.cache.get(key)
+                if decision is None:
+                    decision = self.decide(policy, header, depth, exempt)
+                    self.cache.put(key, decision)
+            if self.calibrator is not None:
+                self.calibrator.observe(request, path, decision.hops)
+        else:
+            decision = policy.decide_missing(exempt)
+            if self.shadow is not None:
+                decision = decision._replace(
+                    shadow=self.shadows[policy].decide_missing(
+                        exempt).verdict)
+
+        verdict = decision.verdict
+        if self.shedder is not None:
+            self.shedder.observe(verdict in VIOLATIONS)
+        if self.throttle is not None and verdict in VIOLATIONS:
+            if self.throttle_peer:
+                key = meta.get('REMOTE_ADDR')
+            else:
+                key = decision.client or self.trusted_entry(header, depth) \
+                    or meta.get('REMOTE_ADDR')
+            if not self.throttle.allow(key):
+                verdict = THROTTLED
+
+        if self.metrics is not None:
+            self.metrics.observe(verdict, decision.hops)
+        if self.shadow is not None and decision.shadow != decision.verdict:
+            self.shadow_metrics.observe_shadow(decision.verdict,
+                                               decision.shadow)
+
+        if verdict == STEALTH:
+            return HttpResponseNotFound()
 
-            if self.rewrite_remote:
-                request.META['REMOTE_ADDR'] = levels[-depth]
+        if verdict == THROTTLED:
+            return THROTTLE
 
-            if self.clean:
-                cleaned = ','.join(levels[-depth:])
-                request.META['HTTP_X_FORWARDED_FOR'] = cleaned
-                request.__dict__.pop("headers", None)  # Clear headers cache
+        if verdict == STRICT_REJECT:
+            logger.warning(
+                'Incorrect proxy depth in incoming request.\n'
+                'Expected %d and got %d remote addresses in '
+                'X-Forwarded-For header.', depth, decision.hops)
+            return HttpResponseBadRequest()
 
-        elif self.header_required and not (exempt or self.loose):
+        if verdict == TOO_FEW or verdict == TOO_FEW_REJECT:
+            logger.warning(
+                'Not running behind as many reverse proxies as expected.\n'
+                'The right value for XFF_TRUSTED_PROXY_DEPTH for this '
+                'request is %d and %d is configured.', decision.hops, depth)
+            if verdict == TOO_FEW_REJECT:
+                return HttpResponseBadRequest()
+        elif verdict == SPOOF or verdict == SPOOF_REJECT:
+            logger.info(
+                'X-Forwarded-For spoof attempt with %d addresses when '
+                '%d expected. Full header: %s', decision.hops, depth, header)
+            if verdict == SPOOF_REJECT:
+                return HttpResponseBadRequest()
+        elif verdict == NO_HEADER_REJECT:
             logger.error(
                 'No X-Forwarded-For header set, not behind a reverse proxy.')
             return HttpResponseBadRequest()
 
-        return self.get_response(request)
+        if decision.client is not None:
+            meta['REMOTE_ADDR'] = decision.client
+
+        if decision.cleaned is not None:
+            meta['HTTP_X_FORWARDED_FOR'] = decision.cleaned
+            request.__dict__.pop("headers", None)  # Clear headers cache
+
+        # Only a header as long as the trusted depth shows which entries
+        # the proxies wrote, otherwise every entry may come from the client
+        if self.forwarded and (verdict == ACCEPT or verdict == SPOOF):
+            self.forward(request, meta, depth, policy.clean)
+
+        return None
+
+    def forward(self, request, meta, depth, clean):
+        '''
+        Apply the entry of each other X-Forwarded-* header at the trusted
+        depth, or its first entry when it is shorter.
+        '''
+        for name, key in self.forwarded:
+            value = meta.get(name)
+            if not value:
+                continue
+            entries = split(value)
+            count = len(entries)
+            position = depth if depth <= count else count
+            trusted = entries[-position]
+            if key == 'wsgi.url_scheme':
+                trusted = trusted.lower()
+                if trusted not in ('http', 'https'):
+                    continue
+                # ASGIRequest reads the scheme from its scope
+                scope = getattr(request, 'scope', None)
+                if scope is not None:
+                    scope['scheme'] = trusted
+            elif key == 'SERVER_PORT' and not trusted.isdigit():
+                continue
+            meta[key] = trusted
+            if clean:
+                meta[name] = ','.join(entries[-position:])
+                request.__dict__.pop("headers", None)
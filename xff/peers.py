@@ -0,0 +1,46 @@
+''' Trusted depth by the address of the direct peer '''
+import functools
+import ipaddress
+
+BITS = {4: 32, 6: 128}
+
+
+class PeerDepths:
+    '''
+    Map the networks of the direct peers to trusted depths.
+
+    The networks are indexed by address family and prefix length, so a
+    lookup is one dict lookup per distinct prefix length, longest first.
+    Results are memoized per peer address in an LRU cache of cache_size
+    entries, as the set of direct peers is small.
+    '''
+    def __init__(self, networks, cache_size=1024):
+        self.index = {4: {}, 6: {}}
+        for network, depth in networks.items():
+            network = ipaddress.ip_network(network)
+            bits = network.max_prefixlen - network.prefixlen
+            by_prefix = self.index[network.version].setdefault(
+                network.prefixlen, {})
+            by_prefix[int(network.network_address) >> bits] = depth
+        self.prefixes = {
+            version: [(BITS[version] - prefixlen, by_prefix)
+                      for prefixlen, by_prefix in sorted(
+                          index.items(), reverse=True)]
+            for version, index in self.index.items()
+        }
+        self.lookup = functools.lru_cache(cache_size)(self.resolve)
+
+    def resolve(self, peer):
+        '''
+        The depth of the most specific network of peer, or None.
+        '''
+        try:
+            address = ipaddress.ip_address(peer)
+        except ValueError:
+            return None
+        value = int(address)
+        for bits, by_prefix in self.prefixes[address.version]:
+            depth = by_prefix.get(value >> bits)
+            if depth is not None:
+                return depth
+        return None
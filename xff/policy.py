@@ -0,0 +1,161 @@
+''' XFF decision policy '''
+from collections import namedtuple
+
+from django.conf import settings
+
+# Verdicts, in the order of the branches of the decision
+ACCEPT = 0
+EXEMPT = 1
+LOOSE = 2
+STEALTH = 3
+STRICT_REJECT = 4
+TOO_FEW = 5
+TOO_FEW_REJECT = 6
+SPOOF = 7
+SPOOF_REJECT = 8
+NO_HEADER = 9
+NO_HEADER_REJECT = 10
+THROTTLED = 11
+SHED = 12
+
+VERDICTS = (
+    'accepted',
+    'exempt',
+    'loose',
+    'stealth',
+    'strict_reject',
+    'too_few',
+    'too_few_reject',
+    'spoof',
+    'spoof_reject',
+    'no_header',
+    'no_header_reject',
+    'throttled',
+    'shed',
+)
+
+REJECTED = frozenset((STEALTH, STRICT_REJECT, TOO_FEW_REJECT, SPOOF_REJECT,
+                      NO_HEADER_REJECT, THROTTLED, SHED))
+
+# Verdicts of a header that is too long or too short
+VIOLATIONS = frozenset((STRICT_REJECT, TOO_FEW, TOO_FEW_REJECT, SPOOF,
+                        SPOOF_REJECT))
+
+Decision = namedtuple('Decision', 'verdict hops client cleaned shadow',
+                      defaults=(None,))
+Decision.__doc__ = '''
+The outcome of a policy for one X-Forwarded-For header.
+
+client is the address to set as REMOTE_ADDR and cleaned the value to set
+as the header. Either is None when it should be left untouched. shadow is
+the verdict of the shadow policy, if one is evaluated.
+'''
+
+
+def split(header):
+    ''' The stripped entries of an X-Forwarded-For header '''
+    return [x.strip() for x in header.split(',')]
+
+
+class Policy:
+    '''
+    The settings that decide what to do with an X-Forwarded-For header.
+
+    A policy is built once and does not look at the request, so the same
+    decision can be reused for the same header, depth and exemption.
+    '''
+    def __init__(self, depth=0, strict=False, always_proxy=False,
+                 no_spoofing=False, header_required=None, loose=False,
+                 stealth=False, clean=True, rewrite_remote=True):
+        self.depth = depth
+        self.strict = strict
+        self.always_proxy = always_proxy
+        self.no_spoofing = no_spoofing
+        if header_required is None:
+            header_required = always_proxy or strict
+        self.header_required = header_required
+        self.loose = loose
+        self.stealth = stealth
+        self.clean = clean
+        self.rewrite_remote = rewrite_remote
+
+        self.missing = Decision(NO_HEADER, 0, None, None)
+        self.missing_required = Decision(
+            NO_HEADER_REJECT if header_required else NO_HEADER, 0, None, None)
+
+    @classmethod
+    def from_settings(cls, overrides=None):
+        '''
+        Build a policy from the XFF settings. overrides is a dict of
+        setting names to use instead of the actual settings.
+        '''
+        overrides = overrides or {}
+
+        def setting(name, default):
+            if name in overrides:
+                return overrides[name]
+            return getattr(settings, name, default)
+
+        return cls(
+            depth=setting('XFF_TRUSTED_PROXY_DEPTH', 0),
+            strict=setting('XFF_STRICT', False),
+            always_proxy=setting('XFF_ALWAYS_PROXY', False),
+            no_spoofing=setting('XFF_NO_SPOOFING', False),
+            header_required=setting('XFF_HEADER_REQUIRED', None),
+            loose=setting('XFF_LOOSE_UNSAFE', False),
+            stealth=setting('XFF_EXEMPT_STEALTH', False),
+            clean=setting('XFF_CLEAN', True),
+            rewrite_remote=setting('XFF_REWRITE_REMOTE_ADDR', True),
+        )
+
+    def is_noop(self):
+        '''
+        True when no header can be rejected or rewritten by this policy.
+        '''
+        return not (
+            self.depth or self.strict or self.always_proxy or
+            self.no_spoofing or self.header_required or
+            self.rewrite_remote or self.clean
+        )
+
+    def decide_missing(self, exempt):
+        ''' Decide a request without the header '''
+        if exempt or self.loose:
+            return self.missing
+        return self.missing_required
+
+    def decide(self, header, depth, exempt):
+        ''' Decide a raw X-Forwarded-For header '''
+        return self.decide_levels(split(header), depth, exempt)
+
+    def decide_levels(self, levels, depth, exempt):
+        ''' Decide an already split X-Forwarded-For header '''
+        hops = len(levels)
+
+        if hops >= depth and exempt and self.stealth:
+            return Decision(STEALTH, hops, None, None)
+
+        if self.loose or exempt:
+            return Decision(EXEMPT if exempt else LOOSE, hops,
+                            levels[0] if self.rewrite_remote else None, None)
+
+        if hops != depth and self.strict:
+            return Decision(STRICT_REJECT, hops, None, None)
+
+        if hops < depth or depth == 0:
+            if self.always_proxy:
+                return Decision(TOO_FEW_REJECT, hops, None, None)
+            verdict = TOO_FEW
+            depth = hops
+        elif hops > depth:
+            if self.no_spoofing:
+                return Decision(SPOOF_REJECT, hops, None, None)
+            verdict = SPOOF
+        else:
+            verdict = ACCEPT
+
+        return Decision(
+            verdict, hops,
+            levels[-depth] if self.rewrite_remote else None,
+            ','.join(levels[-depth:]) if self.clean else None,
+        )
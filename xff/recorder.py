@@ -0,0 +1,105 @@
+''' Sampling of X-Forwarded-For headers for benchmark corpora '''
+import atexit
+import hashlib
+import ipaddress
+import logging
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class HeaderRecorder:
+    '''
+    Keep a uniform random sample of size headers out of all recorded.
+
+    Recording is a counter increment and at most one list assignment, so
+    it can stay enabled in production. The sample is written to path,
+    one header per line, every interval seconds from a background thread,
+    on flush() and at exit. With anonymize, every address is replaced by
+    a pseudonym of the same family before writing, keeping the shape of
+    the header.
+    '''
+    CHECK_EVERY = 1024
+
+    def __init__(self, size, path=None, interval=None, anonymize=False):
+        self.size = size
+        self.path = path
+        self.interval = interval
+        self.anonymize = anonymize
+        self.sample = []
+        self.seen = 0
+        self.next_check = self.CHECK_EVERY
+        self.next_flush = time.monotonic() + interval if interval else None
+        self.key = os.urandom(16)
+        self.random = random.random
+        self.lock = threading.Lock()
+
+    def record(self, header):
+        self.seen += 1
+        if len(self.sample) < self.size:
+            self.sample.append(header)
+        else:
+            index = int(self.random() * self.seen)
+            if index < self.size:
+                self.sample[index] = header
+
+        if self.seen >= self.next_check:
+            self.next_check = self.seen + self.CHECK_EVERY
+            if self.next_flush is not None and \
+                    time.monotonic() >= self.next_flush:
+                self.next_flush = time.monotonic() + self.interval
+                threading.Thread(target=self.flush, daemon=True).start()
+
+    def pseudonym(self, address):
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return 'invalid'
+        digest = hashlib.blake2b(ip.packed, key=self.key).digest()
+        return str(ipaddress.ip_address(digest[:len(ip.packed)]))
+
+    def anonymized(self, header):
+        parts = []
+        for part in header.split(','):
+            address = part.strip()
+            if address:
+                start = part.index(address)
+                part = (part[:start] + self.pseudonym(address) +
+                        part[start + len(address):])
+            parts.append(part)
+        return ','.join(parts)
+
+    def headers(self):
+        sample = self.sample[:]
+        if self.anonymize:
+            return [self.anonymized(header) for header in sample]
+        return sample
+
+    def flush(self, path=None):
+        '''
+        Atomically write the sample to path, by default self.path.
+        Errors are logged, not raised.
+        '''
+        path = path or self.path
+        if self.interval:
+            self.next_flush = time.monotonic() + self.interval
+        if not path:
+            return
+        temp = '%s.%d.tmp' % (path, os.getpid())
+        with self.lock:
+            try:
+                with open(temp, 'w') as corpus:
+                    for header in self.headers():
+                        corpus.write(header + '\n')
+                os.replace(temp, path)
+            except OSError as e:
+                logger.warning('Could not write the XFF header sample to '
+                               '%s: %s', path, e)
+
+    def install(self):
+        ''' Flush at interpreter exit '''
+        atexit.register(self.flush)
+        return self
@@ -0,0 +1,39 @@
+''' Selection of an XFF policy per request '''
+
+
+class PrefixRouter:
+    '''
+    Map path prefixes to values with a character trie.
+
+    lookup() walks the path once and returns the value of the longest
+    matching prefix, or default.
+    '''
+    def __init__(self, rules, default=None):
+        self.default = default
+        self.root = {}
+        for prefix, value in rules:
+            node = self.root
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node[None] = value
+
+    def lookup(self, path):
+        node = self.root
+        value = node.get(None, self.default)
+        for char in path:
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                value = node[None]
+        return value
+
+    def values(self):
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            for key, child in node.items():
+                if key is None:
+                    yield child
+                else:
+                    stack.append(child)
@@ -0,0 +1,64 @@
+''' Load shedding under floods of bad X-Forwarded-For headers '''
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LoadShedder:
+    '''
+    Share of bad requests over a sliding window of the last window
+    requests, kept in SLICES counts of equal size.
+
+    Shedding starts when the share reaches threshold over a full window
+    and stops when it falls below resume, which defaults to half the
+    threshold so the mode does not flap around a single value. Every
+    change is logged once.
+    '''
+    SLICES = 8
+
+    def __init__(self, threshold=0.5, resume=None, window=1000):
+        self.threshold = threshold
+        self.resume = threshold / 2 if resume is None else resume
+        self.slice = max(1, window // self.SLICES)
+        self.slices = [0] * self.SLICES
+        self.position = 0
+        self.filled = 0
+        self.total = 0
+        self.seen = 0
+        self.bad = 0
+        self.shedding = False
+
+    def observe(self, bad):
+        self.seen += 1
+        if bad:
+            self.bad += 1
+        if self.seen >= self.slice:
+            self.rotate()
+
+    def share(self):
+        ''' The share of bad requests in the completed slices '''
+        if not self.filled:
+            return 0.0
+        return self.total / (self.filled * self.slice)
+
+    def rotate(self):
+        self.total += self.bad - self.slices[self.position]
+        self.slices[self.position] = self.bad
+        self.position = (self.position + 1) % self.SLICES
+        self.filled = min(self.filled + 1, self.SLICES)
+        self.seen = self.bad = 0
+
+        share = self.share()
+        if not self.shedding and self.filled == self.SLICES and \
+                share >= self.threshold:
+            self.shedding = True
+            logger.warning(
+                'XFF load shedding on: %.0f%% of the last %d requests had '
+                'bad X-Forwarded-For headers.', share * 100,
+                self.SLICES * self.slice)
+        elif self.shedding and share < self.resume:
+            self.shedding = False
+            logger.warning(
+                'XFF load shedding off: %.0f%% of the last %d requests had '
+                'bad X-Forwarded-For headers.', share * 100,
+                self.SLICES * self.slice)
@@ -0,0 +1,177 @@
+'''
+Warm-start snapshots of the runtime state of the middleware.
+
+A snapshot is a small binary file: a header with a magic, a format
+version, the number of sections and the time it was written, followed by
+sections of a four byte tag, a length and a payload. Readers skip the
+sections they do not know, so sections can be added without a new
+version. All numbers are in native byte order, as a snapshot is only
+read on the host that wrote it.
+
+BUCK  token buckets: key and tokens left when written
+HIST  calibration histograms: path prefix, peer and hop counts
+HOTS  decision cache hot set: policy index, exempt flag, depth and
+      header, least recently used first
+'''
+import mmap
+import os
+import struct
+import time
+
+MAGIC = b'XFFSNAP\0'
+VERSION = 2
+
+HEADER = struct.Struct('=8sHHd')
+SECTION = struct.Struct('=4sI')
+COUNT = struct.Struct('=I')
+SHORT = struct.Struct('=H')
+LENGTH = struct.Struct('=I')
+TOKENS = struct.Struct('=d')
+HOT = struct.Struct('=HBH')
+
+
+class SnapshotError(ValueError):
+    ''' The file is not a snapshot of this version '''
+
+
+def pack_string(value):
+    data = value.encode()
+    return LENGTH.pack(len(data)) + data
+
+
+def unpack_string(data, offset):
+    size, = LENGTH.unpack_from(data, offset)
+    offset += LENGTH.size
+    return bytes(data[offset:offset + size]).decode(), offset + size
+
+
+def encode_buckets(buckets):
+    ''' buckets is a sequence of (key, tokens) '''
+    parts = [COUNT.pack(len(buckets))]
+    for key, tokens in buckets:
+        parts.append(pack_string(key))
+        parts.append(TOKENS.pack(tokens))
+    return b''.join(parts)
+
+
+def decode_buckets(data):
+    count, = COUNT.unpack_from(data)
+    offset = COUNT.size
+    buckets = []
+    for _ in range(count):
+        key, offset = unpack_string(data, offset)
+        tokens, = TOKENS.unpack_from(data, offset)
+        offset += TOKENS.size
+        buckets.append((key, tokens))
+    return buckets
+
+
+def encode_histograms(histograms):
+    ''' histograms is a dict of (prefix, peer) to lists of counts '''
+    width = len(next(iter(histograms.values()), ()))
+    counts = struct.Struct('=%dQ' % width)
+    parts = [COUNT.pack(len(histograms)), SHORT.pack(width)]
+    for (prefix, peer), histogram in histograms.items():
+        parts.append(pack_string(prefix))
+        parts.append(pack_string(peer))
+        parts.append(counts.pack(*histogram))
+    return b''.join(parts)
+
+
+def decode_histograms(data):
+    count, = COUNT.unpack_from(data)
+    width, = SHORT.unpack_from(data, COUNT.size)
+    counts = struct.Struct('=%dQ' % width)
+    offset = COUNT.size + SHORT.size
+    histograms = {}
+    for _ in range(count):
+        prefix, offset = unpack_string(data, offset)
+        peer, offset = unpack_string(data, offset)
+        histograms[(prefix, peer)] = list(counts.unpack_from(data, offset))
+        offset += counts.size
+    return histograms
+
+
+def encode_hot(entries):
+    ''' entries is a sequence of (policy index, exempt, depth, header) '''
+    parts = [COUNT.pack(len(entries))]
+    for index, exempt, depth, header in entries:
+        parts.append(HOT.pack(index, exempt, depth))
+        parts.append(pack_string(header))
+    return b''.join(parts)
+
+
+def decode_hot(data):
+    count, = COUNT.unpack_from(data)
+    offset = COUNT.size
+    entries = []
+    for _ in range(count):
+        index, exempt, depth = HOT.unpack_from(data, offset)
+        header, offset = unpack_string(data, offset + HOT.size)
+        entries.append((index, bool(exempt), depth, header))
+    return entries
+
+
+CODECS = {
+    b'BUCK': ('buckets', encode_buckets, decode_buckets),
+    b'HIST': ('histograms', encode_histograms, decode_histograms),
+    b'HOTS': ('hot', encode_hot, decode_hot),
+}
+
+
+def write(path, state):
+    '''
+    Atomically write a snapshot of state, a dict with any of the keys
+    buckets, histograms and hot.
+    '''
+    sections = []
+    for tag, (name, encode, _) in CODECS.items():
+        if state.get(name):
+            payload = encode(state[name])
+            sections.append(SECTION.pack(tag, len(payload)) + payload)
+    temp = '%s.%d.tmp' % (path, os.getpid())
+    with open(temp, 'wb') as snapshot:
+        snapshot.write(HEADER.pack(MAGIC, VERSION, len(sections),
+                                   time.time()))
+        for section in sections:
+            snapshot.write(section)
+    os.replace(temp, path)
+
+
+def read(path):
+    '''
+    The state in the snapshot at path, with 'age' the seconds since it
+    was written. Raises OSError when it cannot be read and SnapshotError
+    when it is not a valid snapshot.
+    '''
+    with open(path, 'rb') as snapshot:
+        if not os.fstat(snapshot.fileno()).st_size:
+            raise SnapshotError('%s is empty' % path)
+        with mmap.mmap(snapshot.fileno(), 0,
+                       access=mmap.ACCESS_READ) as data:
+            try:
+                return parse(memoryview(data))
+            except (struct.error, UnicodeDecodeError) as e:
+                raise SnapshotError('%s is corrupt: %s' % (path, e))
+
+
+def parse(data):
+    try:
+        magic, version, count, written = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise SnapshotError('not a version %d snapshot' % VERSION)
+        state = {'age': max(0.0, time.time() - written)}
+        offset = HEADER.size
+        for _ in range(count):
+            tag, length = SECTION.unpack_from(data, offset)
+            offset += SECTION.size
+            with data[offset:offset + length] as payload:
+                if len(payload) != length:
+                    raise SnapshotError('section %r is truncated' % tag)
+                if tag in CODECS:
+                    name, _, decode = CODECS[tag]
+                    state[name] = decode(payload)
+            offset += length
+        return state
+    finally:
+        data.release()
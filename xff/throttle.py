@@ -0,0 +1,219 @@
+''' Throttling of clients that keep sending bad X-Forwarded-For headers '''
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # not on Windows, where SharedTokenBuckets is unavailable
+
+
+class TokenBuckets:
+    '''
+    A token bucket per key in a table of at most size keys.
+
+    Every bucket holds up to burst tokens and gains rate tokens per
+    second. When the table is full the least recently used key is
+    dropped, so memory stays bounded however many keys are seen. Updates
+    take a lock, as the table is shared by the threads of a process.
+    '''
+    def __init__(self, rate=1.0, burst=10, size=10000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.size = size
+        self.clock = clock
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def tokens(self, key, now):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            return self.burst
+        return min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+
+    def allow(self, key):
+        '''
+        Take a token from the bucket of key, False when it is empty.
+        '''
+        with self.lock:
+            now = self.clock()
+            tokens = self.tokens(key, now)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+
+            if key in self.buckets:
+                self.buckets.move_to_end(key)
+            elif len(self.buckets) >= self.size:
+                self.buckets.popitem(last=False)
+            self.buckets[key] = [tokens, now]
+        return allowed
+
+    def blocked(self, key):
+        ''' True when the bucket of key is empty, without taking a token '''
+        bucket = self.buckets.get(key)
+        return bucket is not None and self.tokens(key, self.clock()) < 1
+
+    def dump(self):
+        ''' (key, tokens) of every bucket, least recently used first '''
+        now = self.clock()
+        with self.lock:
+            keys = list(self.buckets)
+        return [(key, self.tokens(key, now)) for key in keys
+                if isinstance(key, str)]
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+    def load(self, buckets, age=0):
+        '''
+        Restore buckets from dump(), taken age seconds ago, in front of
+        the ones already here.
+        '''
+        stamp = self.clock() - age
+        with self.lock:
+            current = self.buckets
+            self.buckets = OrderedDict(
+                (key, [tokens, stamp])
+                for key, tokens in buckets[-self.size:])
+            for key, bucket in current.items():
+                self.buckets.pop(key, None)
+                self.buckets[key] = bucket
+            while len(self.buckets) > self.size:
+                self.buckets.popitem(last=False)
+
+
+class SharedTokenBuckets:
+    '''
+    Token buckets in a file shared by all worker processes of a host.
+
+    The file, typically in /dev/shm, is a fixed-size open-addressed hash
+    table memory-mapped by every process. A key is stored by a 64-bit hash
+    in one of PROBES slots from its home slot; when all are taken the
+    least recently updated is replaced. Updates lock the byte range of
+    those slots with fcntl.lockf() against other processes, and one or
+    two of STRIPES locks, by the PROBES aligned ranges the slots are in,
+    against other threads, so keys far apart in the table rarely wait for
+    each other. Only available on POSIX systems.
+    '''
+    HEADER = struct.Struct('=8sQ')
+    SLOT = struct.Struct('=Qdd')
+    MAGIC = b'XFFTB001'
+    PROBES = 8
+    STRIPES = 64
+
+    def __init__(self, path, rate=1.0, burst=10, size=10000, clock=time.time):
+        if fcntl is None:  # pragma: no cover
+            raise RuntimeError('Shared token buckets need fcntl, which is '
+                               'only available on POSIX systems.')
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.locks = [threading.Lock() for _ in range(self.STRIPES)]
+
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, self.HEADER.size)
+        try:
+            if os.fstat(self.fd).st_size >= self.HEADER.size:
+                magic, slots = self.HEADER.unpack(
+                    os.pread(self.fd, self.HEADER.size, 0))
+                if magic != self.MAGIC:
+                    raise ValueError('%s is not a token bucket table' % path)
+            else:
+                slots = size + self.PROBES
+                os.ftruncate(self.fd, self.HEADER.size +
+                             slots * self.SLOT.size)
+                os.pwrite(self.fd, self.HEADER.pack(self.MAGIC, slots), 0)
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, self.HEADER.size)
+
+        self.size = slots - self.PROBES
+        self.mmap = mmap.mmap(self.fd, self.HEADER.size +
+                              slots * self.SLOT.size)
+
+    def offset(self, index):
+        return self.HEADER.size + index * self.SLOT.size
+
+    @staticmethod
+    def hash(key):
+        digest = hashlib.blake2b(str(key).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'little') or 1
+
+    def find(self, hashed):
+        '''
+        The slot index of hashed, or of the slot to replace, and whether
+        it was found.
+        '''
+        home = hashed % self.size
+        oldest = None
+        for index in range(home, home + self.PROBES):
+            slot_hash, tokens, stamp = self.SLOT.unpack_from(
+                self.mmap, self.offset(index))
+            if slot_hash == hashed:
+                return index, True
+            if not slot_hash:
+                return index, False
+            if oldest is None or stamp < oldest[1]:
+                oldest = (index, stamp)
+        return oldest[0], False
+
+    def tokens(self, index, found, now):
+        if not found:
+            return self.burst
+        _, tokens, stamp = self.SLOT.unpack_from(self.mmap,
+                                                 self.offset(index))
+        return min(self.burst, tokens + (now - stamp) * self.rate)
+
+    def stripes(self, home):
+        '''
+        The locks of the slots from home, in a fixed order so that
+        threads taking two never deadlock.
+        '''
+        first = home // self.PROBES % self.STRIPES
+        last = (home + self.PROBES - 1) // self.PROBES % self.STRIPES
+        if first == last:
+            return [self.locks[first]]
+        return [self.locks[min(first, last)], self.locks[max(first, last)]]
+
+    def allow(self, key):
+        '''
+        Take a token from the bucket of key, False when it is empty.
+        '''
+        hashed = self.hash(key)
+        home = hashed % self.size
+        start = self.offset(home)
+        length = self.PROBES * self.SLOT.size
+        locks = self.stripes(home)
+        for lock in locks:
+            lock.acquire()
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, length, start)
+            try:
+                now = self.clock()
+                index, found = self.find(hashed)
+                tokens = self.tokens(index, found, now)
+                allowed = tokens >= 1
+                if allowed:
+                    tokens -= 1
+                self.SLOT.pack_into(self.mmap, self.offset(index),
+                                    hashed, tokens, now)
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, length, start)
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+        return allowed
+
+    def blocked(self, key):
+        '''
+        True when the bucket of key is empty. Reads without locking.
+        '''
+        index, found = self.find(self.hash(key))
+        return found and self.tokens(index, True, self.clock()) < 1
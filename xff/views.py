@@ -0,0 +1,46 @@
+''' XFF views '''
+from django.http import HttpResponse, JsonResponse
+
+from . import cache
+from . import calibrate
+from . import log
+from . import metrics as xff_metrics
+
+
+def metrics(request):
+    '''
+    Middleware counters in the Prometheus text exposition format.
+
+    The decision cache and log queue counters are those of the process
+    serving the view. Add it to the URLconf behind whatever protects internal
+    endpoints.
+    '''
+    counters = []
+    decisions = cache.decision_cache
+    if decisions is not None:
+        counters += [
+            ('xff_decision_cache_hits_total',
+             'Decisions found in the cache.', decisions.hits),
+            ('xff_decision_cache_misses_total',
+             'Decisions not found in the cache.', decisions.misses),
+            ('xff_decision_cache_evictions_total',
+             'Decisions evicted from the full cache.', decisions.evictions),
+        ]
+    if log.shipper is not None:
+        counters.append((
+            'xff_log_records_dropped_total',
+            'Log records dropped from the full log queue.',
+            log.shipper.dropped))
+    return HttpResponse(
+        xff_metrics.registry.render() + xff_metrics.render_counters(counters),
+        content_type=xff_metrics.CONTENT_TYPE)
+
+
+def calibration(request):
+    '''
+    Recommended XFF_TRUSTED_PROXY_DEPTH from the sampled hop counts.
+    '''
+    calibrator = calibrate.calibrator
+    return JsonResponse({
+        'recommendations': calibrator.recommend() if calibrator else [],
+    })